@@ -1,58 +1,176 @@
 
-import requests
-import json
+import orjson
 import random
-import socket
-import configparser
+import argparse
 import os
+import base64
+import hashlib
+import logging
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 
+# Command line options
+parser = argparse.ArgumentParser(description="Provision this laptop as a ThingsBoard device.")
+parser.add_argument('--refresh-geo', action='store_true',
+                    help="Ignore the cached geolocation and query ipapi.co again")
+
+log = logging.getLogger('provision')
+
+# Geolocation cache (stored next to config.properties)
+GEO_CACHE_FILE = '_geo_cache.json'
+GEO_CACHE_TTL = 24 * 60 * 60  # seconds
+
+# Tokens already validated against /api/auth/user, keyed by sha256 of the JWT
+TOKEN_CACHE_FILE = '_token_cache.json'
+TOKEN_EXPIRY_MARGIN = 60  # seconds; revalidate tokens this close to expiry
+
+@dataclass(frozen=True, slots=True)
+class Cfg:
+    """Settings read once from config.properties."""
+    thingsboard_url: str
+    jwt_token: str
+    country_name: str
+    state_name: str
+    serial_number: str
+    country_profile_name: str
+    state_profile_name: str
+    device_profile_name: str
+    device_profile_id: str
+    # Fallback coordinates, used when geolocation fails
+    latitude: float | None = None
+    longitude: float | None = None
+
 # Load configuration from config.properties file
 def load_config():
     """Load configuration from config.properties file."""
-    config = configparser.ConfigParser()
+    import configparser
+    config = configparser.ConfigParser(interpolation=None)
     config_file = 'config.properties'
     
     if not os.path.exists(config_file):
-        print(f"❌ Configuration file '{config_file}' not found!")
+        log.error(f"❌ Configuration file '{config_file}' not found!")
         exit(1)
     
     try:
         config.read(config_file)
-        print(f"✅ Loaded configuration from {config_file}")
-        return config
+        cfg = Cfg(
+            thingsboard_url=config.get('thingsboard', 'url'),
+            jwt_token=config.get('thingsboard', 'jwt_token'),
+            country_name=config.get('assets', 'country_name'),
+            state_name=config.get('assets', 'state_name'),
+            serial_number=config.get('assets', 'serial_number'),
+            country_profile_name=config.get('profiles', 'country_profile_name'),
+            state_profile_name=config.get('profiles', 'state_profile_name'),
+            device_profile_name=config.get('profiles', 'device_profile_name'),
+            device_profile_id=config.get('profiles', 'device_profile_id'),
+            latitude=config.getfloat('location', 'latitude', fallback=None),
+            longitude=config.getfloat('location', 'longitude', fallback=None)
+        )
+        log.info(f"✅ Loaded configuration from {config_file}")
+        return cfg
     except Exception as e:
-        print(f"❌ Error reading configuration file: {e}")
+        log.error(f"❌ Error reading configuration file: {e}")
         exit(1)
 
-# Load configuration
-config = load_config()
-
-# ThingsBoard Configuration
-THINGSBOARD_URL = config.get('thingsboard', 'url')
-JWT_TOKEN = config.get('thingsboard', 'jwt_token')
-HEADERS = {
-    "Content-Type": "application/json",
-    "X-Authorization": f"Bearer {JWT_TOKEN}"
-}
-
-# Asset Configuration
-COUNTRY_NAME = config.get('assets', 'country_name')
-STATE_NAME = config.get('assets', 'state_name')
-SERIAL_NUMBER = config.get('assets', 'serial_number')
+# Set by main(): loaded configuration, device coordinates and device name
+CFG = None
+LAT = LON = None
+DEVICE_NAME = None
+
+# (connect, read) timeout for every ThingsBoard request, so a stalled server can't hang the run
+REQUEST_TIMEOUT = (3.05, 10)
+
+@functools.cache
+def _session():
+    """Return the shared keep-alive session for all ThingsBoard calls.
+
+    requests (and urllib3/ssl behind it) is imported on first use, so runs
+    that stop on a config error never pay for loading it.
+    """
+    import socket
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    class KeepAliveAdapter(HTTPAdapter):
+        """HTTPAdapter whose pooled sockets disable Nagle's algorithm and use TCP keep-alive."""
+        socket_options = [
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs['socket_options'] = self.socket_options
+            super().init_poolmanager(*args, **kwargs)
+    
+    session = requests.Session()
+    # The JWT is set by main() on every call, since a later run may load a refreshed token
+    session.headers["Content-Type"] = "application/json"
+    # ThingsBoard is often served over plain http (e.g. :8080), so pool both schemes
+    adapter = KeepAliveAdapter(
+        pool_connections=2,
+        pool_maxsize=8,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def _json(r):
+    """Decode a response body with orjson."""
+    return orjson.loads(r.content)
+
+def _post(url, payload):
+    """POST payload as orjson-encoded JSON over the shared session."""
+    return _session().post(url, data=orjson.dumps(payload), timeout=REQUEST_TIMEOUT)
+
+
+def load_cached_location():
+    """Return the cached (lat, lon, country, state) tuple, or None if missing or stale."""
+    try:
+        with open(GEO_CACHE_FILE, 'rb') as f:
+            entry = orjson.loads(f.read())
+        data = entry['data']
+        # Ignore a corrupt or hand-edited entry rather than fail unpacking it later
+        if time.time() - entry['ts'] < GEO_CACHE_TTL and isinstance(data, list) and len(data) == 4:
+            return tuple(data)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
 
+def save_cached_location(location):
+    """Store a successful geolocation result so repeat runs skip the lookup."""
+    try:
+        with open(GEO_CACHE_FILE, 'wb') as f:
+            f.write(orjson.dumps({'ts': time.time(), 'data': list(location)}))
+    except OSError as e:
+        log.warning(f"⚠️ Could not write geolocation cache: {e}")
 
 # Auto-detect laptop location and get country/state names
-def get_laptop_location_and_address():
-    """Get laptop's current location and address using IP-based geolocation."""
+def get_laptop_location_and_address(refresh=False):
+    """Get laptop's current location and address using IP-based geolocation.
+
+    Results are cached in GEO_CACHE_FILE for GEO_CACHE_TTL seconds; pass
+    refresh=True to bypass the cache.
+    """
+    import requests
+    if not refresh:
+        cached = load_cached_location()
+        if cached:
+            log.info(f"📍 Using cached location: {cached[0]}, {cached[1]} ({cached[3]}, {cached[2]})")
+            return cached
+    
     try:
-        print("🌍 Detecting laptop location...")
+        log.info("🌍 Detecting laptop location...")
         
         # Using ipapi.co for free IP geolocation with detailed address info
         response = requests.get('https://ipapi.co/json/', timeout=10)
         response.raise_for_status()
         
-        location_data = response.json()
+        location_data = _json(response)
         latitude = location_data.get('latitude')
         longitude = location_data.get('longitude')
         city = location_data.get('city', 'Unknown')
@@ -61,258 +179,347 @@ def get_laptop_location_and_address():
         country_code = location_data.get('country_code', 'Unknown')
         
         if latitude and longitude:
-            print(f"📍 Location detected: {city}, {region}, {country}")
-            print(f"📍 Coordinates: {latitude}, {longitude}")
-            print(f"🏛️ Country: {country} ({country_code})")
-            print(f"🏙️ State/Region: {region}")
+            log.info(f"📍 Location detected: {city}, {region}, {country}")
+            log.info(f"📍 Coordinates: {latitude}, {longitude}")
+            log.info(f"🏛️ Country: {country} ({country_code})")
+            log.info(f"🏙️ State/Region: {region}")
             
             # Format names for ThingsBoard (uppercase for consistency)
             country_name = country.upper() if country != 'Unknown' else 'UNKNOWN'
             state_name = region.upper() if region != 'Unknown' else city.upper()
             
-            return float(latitude), float(longitude), country_name, state_name
+            location = (float(latitude), float(longitude), country_name, state_name)
+            save_cached_location(location)
+            return location
         else:
-            print("⚠️ Could not get coordinates from IP geolocation")
+            log.warning("⚠️ Could not get coordinates from IP geolocation")
             return None, None, None, None
             
     except requests.exceptions.RequestException as e:
-        print(f"⚠️ Network error getting location: {e}")
+        log.warning(f"⚠️ Network error getting location: {e}")
         return None, None, None, None
     except Exception as e:
-        print(f"⚠️ Error getting laptop location: {e}")
+        log.warning(f"⚠️ Error getting laptop location: {e}")
         return None, None, None, None
 
-# Get laptop's current location for coordinates only (ignore country/state from IP)
-LAT, LON, _, _ = get_laptop_location_and_address()
-
-# Always use config values for country and state names
-print(f"✅ Using config values - Country: {COUNTRY_NAME}, State: {STATE_NAME}")
-
-# Use detected coordinates if available, otherwise fallback to config coordinates
-if LAT is not None and LON is not None:
-    print(f"📍 Using detected coordinates: {LAT}, {LON}")
-else:
-    print("🔄 Falling back to config coordinates...")
-    LAT = config.getfloat('location', 'latitude')
-    LON = config.getfloat('location', 'longitude')
-    print(f"📍 Using config coordinates: {LAT}, {LON}")
-
-# Profile Configuration
-COUNTRY_PROFILE_NAME = config.get('profiles', 'country_profile_name')
-STATE_PROFILE_NAME = config.get('profiles', 'state_profile_name')
-DEVICE_PROFILE_NAME = config.get('profiles', 'device_profile_name')
-DEVICE_PROFILE_ID = config.get('profiles', 'device_profile_id')
+def resolve_coordinates(refresh=False):
+    """Return (lat, lon) from geolocation, falling back to the config coordinates."""
+    # Get laptop's current location for coordinates only (ignore country/state from IP)
+    lat, lon, _, _ = get_laptop_location_and_address(refresh=refresh)
+    
+    # Use detected coordinates if available, otherwise fallback to config coordinates
+    if lat is not None and lon is not None:
+        log.info(f"📍 Using detected coordinates: {lat}, {lon}")
+        return lat, lon
+    
+    log.info("🔄 Falling back to config coordinates...")
+    if CFG.latitude is None or CFG.longitude is None:
+        log.error("❌ No [location] latitude/longitude configured in config.properties")
+        exit(1)
+    log.info(f"📍 Using config coordinates: {CFG.latitude}, {CFG.longitude}")
+    return CFG.latitude, CFG.longitude
 
 # Auto-generate device name using system hostname
 def generate_device_name(country, state):
     """Generate a device name based on country, state, and system hostname."""
+    import socket
     try:
         system_name = socket.gethostname()
-        print(f"🖥️ System hostname: {system_name}")
+        log.info(f"🖥️ System hostname: {system_name}")
         return f"{system_name}"
     except Exception as e:
-        print(f"⚠️ Could not get system hostname: {e}")
+        log.warning(f"⚠️ Could not get system hostname: {e}")
         # Fallback to timestamp if hostname fails
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         return f"papaya_{country}_{state}_{timestamp}"
 
-DEVICE_NAME = generate_device_name(COUNTRY_NAME, STATE_NAME)
+def _jwt_expiry(token):
+    """Return the exp claim of a JWT as a Unix timestamp, or None if it can't be read."""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(orjson.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+def _load_token_cache():
+    """Return {sha256 of token: exp}; a missing or corrupt cache reads as empty."""
+    try:
+        with open(TOKEN_CACHE_FILE, 'rb') as f:
+            cache = orjson.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    # Drop hand-edited or corrupt entries rather than fail comparing them later
+    return {key: exp for key, exp in cache.items()
+            if isinstance(exp, (int, float)) and not isinstance(exp, bool)}
+
+def _save_token_validation(token_key, expiry):
+    """Record a successful validation, dropping entries for tokens that have expired."""
+    now = time.time()
+    cache = {key: exp for key, exp in _load_token_cache().items() if exp > now}
+    cache[token_key] = expiry
+    try:
+        with open(TOKEN_CACHE_FILE, 'wb') as f:
+            f.write(orjson.dumps(cache))
+    except OSError as e:
+        log.warning(f"⚠️ Could not write token cache: {e}")
 
 def validate_token():
-    """Validate JWT token by checking user info."""
+    """Validate JWT token by checking user info.
+
+    A token that already passed validation on an earlier run is trusted until
+    it comes within TOKEN_EXPIRY_MARGIN seconds of its exp claim.
+    """
+    token_key = hashlib.sha256(CFG.jwt_token.encode()).hexdigest()
+    expiry = _jwt_expiry(CFG.jwt_token)
+    if expiry is not None and expiry - time.time() >= TOKEN_EXPIRY_MARGIN:
+        if _load_token_cache().get(token_key) == expiry:
+            log.info(f"✅ Token valid (cached) - expires {datetime.fromtimestamp(expiry)}")
+            return True
+    
     try:
-        url = f"{THINGSBOARD_URL}/api/auth/user"
-        r = requests.get(url, headers=HEADERS)
+        url = f"{CFG.thingsboard_url}/api/auth/user"
+        r = _session().get(url, timeout=REQUEST_TIMEOUT)
         if r.status_code == 200:
-            user_info = r.json()
-            print(f"✅ Token valid - User: {user_info.get('firstName', '')} {user_info.get('lastName', '')}")
+            user_info = _json(r)
+            log.info(f"✅ Token valid - User: {user_info.get('firstName', '')} {user_info.get('lastName', '')}")
+            if expiry is not None:
+                _save_token_validation(token_key, expiry)
             return True
         elif r.status_code == 401:
-            print("❌ Token expired or invalid")
+            log.error("❌ Token expired or invalid")
             return False
         elif r.status_code == 403:
-            print("❌ Token lacks permissions")
+            log.error("❌ Token lacks permissions")
             return False
         else:
-            print(f"❌ Token validation failed: {r.status_code}")
+            log.error(f"❌ Token validation failed: {r.status_code}")
             return False
     except Exception as e:
-        print(f"❌ Token validation error: {e}")
+        log.error(f"❌ Token validation error: {e}")
         return False
 
+# Pre-serialized request bodies; only the %s fields vary per call and are JSON-encoded individually
+_ASSET_TMPL = (b'{"name":%s,"type":%s,'
+               b'"assetProfileId":{"entityType":"ASSET_PROFILE","id":%s},'
+               b'"additionalInfo":{"description":%s}}')
+_DEVICE_TMPL = (b'{"name":%s,"label":%s,'
+                b'"deviceProfileId":{"entityType":"DEVICE_PROFILE","id":%s},'
+                b'"additionalInfo":{"gateway":false,"overwriteActivityTime":false,'
+                b'"description":"Simulated IoT device"}}')
+_RELATION_TMPL = (b'{"from":{"id":%s,"entityType":%s},"to":{"id":%s,"entityType":%s},'
+                  b'"type":"Contains","typeGroup":"COMMON"}')
+
 def create_asset(name, profile_id, type_name):
-    payload = {
-        "name": name,
-        "type": type_name,
-        "assetProfileId": {
-            "entityType": "ASSET_PROFILE",
-            "id": profile_id
-        },
-        "additionalInfo": {
-            "description": f"{type_name} asset created by simulator"
-        }
-    }
+    import requests
+    body = _ASSET_TMPL % (orjson.dumps(name), orjson.dumps(type_name), orjson.dumps(profile_id),
+                          orjson.dumps(f"{type_name} asset created by simulator"))
     try:
-        r = requests.post(f"{THINGSBOARD_URL}/api/asset", headers=HEADERS, json=payload)
+        r = _session().post(f"{CFG.thingsboard_url}/api/asset", data=body, timeout=REQUEST_TIMEOUT)
         if r.status_code == 403:
-            print(f"❌ 403 Forbidden: No permission to create {type_name} assets")
-            print("Check if your token has TENANT_ADMIN permissions")
-            print(f"Response: {r.text}")
+            log.error(f"❌ 403 Forbidden: No permission to create {type_name} assets")
+            log.info("Check if your token has TENANT_ADMIN permissions")
+            log.info(f"Response: {r.text}")
             raise Exception("Insufficient permissions to create assets")
         r.raise_for_status()
-        return r.json()
+        return _json(r)
     except requests.exceptions.HTTPError as e:
-        print(f"❌ HTTP Error creating {type_name}: {e}")
-        print(f"Response: {r.text}")
+        log.error(f"❌ HTTP Error creating {type_name}: {e}")
+        log.info(f"Response: {r.text}")
         raise
     except Exception as e:
-        print(f"❌ Error creating {type_name}: {e}")
+        log.error(f"❌ Error creating {type_name}: {e}")
         raise
 
 def send_asset_attributes(entity_type, entity_id, latitude, longitude):
-    url = f"{THINGSBOARD_URL}/api/plugins/telemetry/{entity_type}/{entity_id}/attributes/SERVER_SCOPE"
+    url = f"{CFG.thingsboard_url}/api/plugins/telemetry/{entity_type}/{entity_id}/attributes/SERVER_SCOPE"
     payload = {
         "latitude": latitude,
         "longitude": longitude
     }
-    r = requests.post(url, headers=HEADERS, json=payload)
+    r = _post(url, payload)
     r.raise_for_status()
-    print(f"✅ Sent latitude/longitude to {entity_type} {entity_id}")
+    log.info(f"✅ Sent latitude/longitude to {entity_type} {entity_id}")
 
 def create_device(name, device_profile_id):
-    payload = {
-        "name": name,
-        "label": name,
-        "deviceProfileId": {
-            "entityType": "DEVICE_PROFILE",
-            "id": device_profile_id
-        },
-        "additionalInfo": {
-            "gateway": False,
-            "overwriteActivityTime": False,
-            "description": "Simulated IoT device"
-        }
-    }
-    r = requests.post(f"{THINGSBOARD_URL}/api/device", headers=HEADERS, json=payload)
+    encoded_name = orjson.dumps(name)
+    body = _DEVICE_TMPL % (encoded_name, encoded_name, orjson.dumps(device_profile_id))
+    r = _session().post(f"{CFG.thingsboard_url}/api/device", data=body, timeout=REQUEST_TIMEOUT)
     r.raise_for_status()
-    return r.json()
+    return _json(r)
 
-def assign_child_asset(parent_id, child_id):
-    url = f"{THINGSBOARD_URL}/api/relation"
-    relation_payload = {
-        "from": {
-            "id": parent_id,
-            "entityType": "ASSET"
-        },
-        "to": {
-            "id": child_id,
-            "entityType": "ASSET"
-        },
-        "type": "Contains",
-        "typeGroup": "COMMON"
-    }
-    r = requests.post(url, headers=HEADERS, json=relation_payload)
+def _post_relation(from_id, from_type, to_id, to_type):
+    body = _RELATION_TMPL % (orjson.dumps(from_id), orjson.dumps(from_type), orjson.dumps(to_id), orjson.dumps(to_type))
+    r = _session().post(f"{CFG.thingsboard_url}/api/relation", data=body, timeout=REQUEST_TIMEOUT)
     r.raise_for_status()
+    check_relation_exists.cache_clear()
+
+def assign_child_asset(parent_id, child_id):
+    _post_relation(parent_id, "ASSET", child_id, "ASSET")
 
 def assign_device_to_asset(device_id, asset_id):
-    url = f"{THINGSBOARD_URL}/api/relation"
-    relation_payload = {
-        "from": {
-            "id": asset_id,
-            "entityType": "ASSET"
-        },
-        "to": {
-            "id": device_id,
-            "entityType": "DEVICE"
-        },
-        "type": "Contains",
-        "typeGroup": "COMMON"
-    }
-    r = requests.post(url, headers=HEADERS, json=relation_payload)
-    r.raise_for_status()
+    _post_relation(asset_id, "ASSET", device_id, "DEVICE")
+
+def create_asset_with_attributes(name, profile_id, type_name, latitude, longitude, parent_id=None):
+    """Create an asset, write its coordinates and link it under parent_id.
+
+    The attribute write and the relation only need the new asset's ID, so they
+    are sent concurrently over the pooled session once the asset exists.
+    """
+    asset = create_asset(name, profile_id, type_name)
+    asset_id = asset["id"]["id"]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(send_asset_attributes, "ASSET", asset_id, latitude, longitude)]
+        if parent_id:
+            futures.append(executor.submit(assign_child_asset, parent_id, asset_id))
+    for future in futures:
+        future.result()
+    return asset
+
+# Device tokens rarely change, but are only reused for a short while
+CREDENTIALS_TTL = 300  # seconds
+_credentials_cache = {}
 
 def get_device_credentials(device_id):
-    url = f"{THINGSBOARD_URL}/api/device/{device_id}/credentials"
-    r = requests.get(url, headers=HEADERS)
+    cached = _credentials_cache.get(device_id)
+    if cached and time.time() - cached[0] < CREDENTIALS_TTL:
+        return cached[1]
+    
+    url = f"{CFG.thingsboard_url}/api/device/{device_id}/credentials"
+    r = _session().get(url, timeout=REQUEST_TIMEOUT)
     r.raise_for_status()
-    return r.json()["credentialsId"]
-
-def send_telemetry(device_token):
-    telemetry_url = f"{THINGSBOARD_URL}/api/v1/{device_token}/telemetry"
-    payload = {
-        "serialNumber": SERIAL_NUMBER,
-        "country": COUNTRY_NAME,
-        "state": STATE_NAME,
+    token = _json(r)["credentialsId"]
+    _credentials_cache[device_id] = (time.time(), token)
+    return token
+
+def _telemetry_values(temperature):
+    return {
+        "serialNumber": CFG.serial_number,
+        "country": CFG.country_name,
+        "state": CFG.state_name,
         "latitude": LAT,
         "longitude": LON,
-        "temperature": round(random.uniform(20, 40), 2)
+        "temperature": temperature
     }
-    r = requests.post(telemetry_url, json=payload)
-    r.raise_for_status()
-    print("Telemetry sent:", payload)
 
-def list_all_assets():
-    """List all existing assets for debugging."""
-    print("\n📋 All existing assets:")
+def send_telemetry(device_token):
+    telemetry_url = f"{CFG.thingsboard_url}/api/v1/{device_token}/telemetry"
+    payload = _telemetry_values(round(random.random() * 20 + 20, 2))
+    r = _post(telemetry_url, payload)
+    r.raise_for_status()
+    log.info("Telemetry sent: %s", payload)
+
+def send_telemetry_batch(device_token, n, interval_ms=1000):
+    """Send n timestamped samples, interval_ms apart and ending now, in one POST."""
+    telemetry_url = f"{CFG.thingsboard_url}/api/v1/{device_token}/telemetry"
+    rand = random.random
+    start = int(time.time() * 1000) - (n - 1) * interval_ms
+    payload = [{"ts": start + i * interval_ms, "values": _telemetry_values(round(rand() * 20 + 20, 2))}
+               for i in range(n)]
+    r = _post(telemetry_url, payload)
+    r.raise_for_status()
+    log.info(f"Telemetry sent: {n} samples")
+
+# Tenant asset list, fetched once per run by fetch_all_assets()
+_asset_cache = None
+# Bumped on every fetch so name indexes built from an older list are discarded
+_asset_generation = 0
+
+def fetch_all_assets(refresh=False):
+    """Fetch all tenant assets.
+
+    The list is fetched once and cached for the rest of the run; pass
+    refresh=True to fetch it again.
+    """
+    global _asset_cache, _asset_generation
+    if _asset_cache is not None and not refresh:
+        return _asset_cache
+    
     try:
-        url = f"{THINGSBOARD_URL}/api/tenant/assets"
+        url = f"{CFG.thingsboard_url}/api/tenant/assets"
         params = {
             "pageSize": 1000,
             "page": 0,
             "sortProperty": "name",
             "sortOrder": "ASC"
         }
-        r = requests.get(url, headers=HEADERS, params=params)
+        r = _session().get(url, params=params, timeout=REQUEST_TIMEOUT)
         r.raise_for_status()
         
-        assets = r.json().get("data", [])
-        if not assets:
-            print("  No assets found!")
-            return []
-        
-        for asset in assets:
-            print(f"  - Name: '{asset['name']}', Type: '{asset['type']}', ID: {asset['id']['id']}")
-        return assets
+        _asset_cache = _json(r).get("data", [])
+        _asset_generation += 1
+        return _asset_cache
     except Exception as e:
-        print(f"  ❌ Error fetching assets: {e}")
+        log.error(f"❌ Error fetching assets: {e}")
         return []
 
+def log_assets(assets):
+    """List assets for debugging."""
+    lines = ["", "📋 All existing assets:"]
+    if assets:
+        lines.extend(f"  - Name: '{asset['name']}', Type: '{asset['type']}', ID: {asset['id']['id']}"
+                     for asset in assets)
+    else:
+        lines.append("  No assets found!")
+    log.debug("\n".join(lines))
+
+@functools.lru_cache(maxsize=1)
+def _asset_index(generation):
+    """Group the cached asset list by case-folded name, keeping fetch order."""
+    index = {}
+    for asset in _asset_cache or []:
+        index.setdefault(asset['name'].casefold(), []).append(asset)
+    return index
+
+def asset_name_index():
+    """Return {case-folded name: [assets]} for the current asset list."""
+    fetch_all_assets()
+    return _asset_index(_asset_generation)
+
 def find_asset_by_name(name, asset_type):
     """Find asset by name and type. Returns asset data if found, None otherwise."""
-    print(f"🔍 Searching for asset: name='{name}', type='{asset_type}'")
-    
-    url = f"{THINGSBOARD_URL}/api/tenant/assets"
-    params = {
-        "pageSize": 1000,
-        "page": 0,
-        "sortProperty": "name",
-        "sortOrder": "ASC"
-    }
-    r = requests.get(url, headers=HEADERS, params=params)
-    r.raise_for_status()
+    log.info(f"🔍 Searching for asset: name='{name}', type='{asset_type}'")
     
-    assets = r.json().get("data", [])
-    print(f"📊 Found {len(assets)} total assets")
+    folded_name = name.casefold()
+    if _asset_cache is not None:
+        name_matches = asset_name_index().get(folded_name, [])
+    else:
+        # Let the server narrow the list instead of pulling every tenant asset.
+        # textSearch is a prefix match, so keep the exact-name filter below.
+        url = f"{CFG.thingsboard_url}/api/tenant/assets"
+        params = {
+            "pageSize": 20,
+            "page": 0,
+            "textSearch": name,
+            "sortProperty": "name",
+            "sortOrder": "ASC"
+        }
+        r = _session().get(url, params=params, timeout=REQUEST_TIMEOUT)
+        r.raise_for_status()
+        name_matches = [asset for asset in _json(r).get("data", []) if asset["name"].casefold() == folded_name]
     
     # Debug: show all assets that match the name
-    name_matches = [asset for asset in assets if asset["name"].lower() == name.lower()]
-    if name_matches:
-        print(f"🎯 Assets matching name '{name}':")
+    if name_matches and log.isEnabledFor(logging.DEBUG):
+        log.debug(f"🎯 Assets matching name '{name}':")
         for asset in name_matches:
-            print(f"  - Name: '{asset['name']}', Type: '{asset['type']}'")
+            log.debug(f"  - Name: '{asset['name']}', Type: '{asset['type']}'")
     
     # Find exact match
-    for asset in assets:
-        if asset["name"].lower() == name.lower() and asset["type"].lower() == asset_type.lower():
-            print(f"✅ Found exact match: {asset['name']} ({asset['type']})")
+    folded_type = asset_type.casefold()
+    for asset in name_matches:
+        if asset["type"].casefold() == folded_type:
+            log.info(f"✅ Found exact match: {asset['name']} ({asset['type']})")
             return asset
     
-    print(f"❌ No exact match found for '{name}' with type '{asset_type}'")
+    log.error(f"❌ No exact match found for '{name}' with type '{asset_type}'")
     return None
 
+@functools.lru_cache(maxsize=128)
 def check_relation_exists(parent_id, child_id, parent_type="ASSET", child_type="ASSET"):
     """Check if relation already exists between two entities."""
-    url = f"{THINGSBOARD_URL}/api/relation/info"
+    url = f"{CFG.thingsboard_url}/api/relation/info"
     params = {
         "fromId": parent_id,
         "fromType": parent_type,
@@ -320,218 +527,232 @@ def check_relation_exists(parent_id, child_id, parent_type="ASSET", child_type="
         "toType": child_type,
         "relationType": "Contains"
     }
-    r = requests.get(url, headers=HEADERS, params=params)
+    r = _session().get(url, params=params, timeout=REQUEST_TIMEOUT)
     return r.status_code == 200
 
-def get_asset_profile_id_by_name(profile_name):
-    """Get asset profile ID by name."""
-    url = f"{THINGSBOARD_URL}/api/assetProfiles"
-    params = {
-        "pageSize": 1000,
-        "page": 0,
-        "textSearch": profile_name,
-        "sortProperty": "name",
-        "sortOrder": "ASC"
-    }
-    r = requests.get(url, headers=HEADERS, params=params)
+def _fetch_profiles(endpoint):
+    """Return the first 1000 profiles from a profile list endpoint."""
+    url = f"{CFG.thingsboard_url}/api/{endpoint}"
+    params = {"pageSize": 1000, "page": 0, "sortProperty": "name", "sortOrder": "ASC"}
+    r = _session().get(url, params=params, timeout=REQUEST_TIMEOUT)
     r.raise_for_status()
-    
-    profiles = r.json().get("data", [])
+    return _json(r).get("data", [])
+
+@functools.cache
+def list_profiles_once():
+    """Fetch the asset and device profile lists once per run, as (asset_profiles, device_profiles)."""
+    # Both lists are independent, so fetch them concurrently over the pooled session
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        asset_profiles = executor.submit(_fetch_profiles, "assetProfiles")
+        device_profiles = executor.submit(_fetch_profiles, "deviceProfiles")
+    return asset_profiles.result(), device_profiles.result()
+
+def _profile_id_by_name(profiles, profile_name):
     for profile in profiles:
         if profile["name"] == profile_name:
             return profile["id"]["id"]
     return None
 
+def get_asset_profile_id_by_name(profile_name):
+    """Get asset profile ID by name."""
+    return _profile_id_by_name(list_profiles_once()[0], profile_name)
+
 def get_device_profile_id_by_name(profile_name):
     """Get device profile ID by name."""
-    url = f"{THINGSBOARD_URL}/api/deviceProfiles"
-    params = {
-        "pageSize": 1000,
-        "page": 0,
-        "textSearch": profile_name,
-        "sortProperty": "name",
-        "sortOrder": "ASC"
-    }
-    r = requests.get(url, headers=HEADERS, params=params)
-    r.raise_for_status()
-    
-    profiles = r.json().get("data", [])
-    for profile in profiles:
-        if profile["name"] == profile_name:
-            return profile["id"]["id"]
-    return None
+    return _profile_id_by_name(list_profiles_once()[1], profile_name)
+
+def clear_provision_caches():
+    """Drop every per-run lookup cache (assets, profiles, relations, credentials)."""
+    global _asset_cache
+    _asset_cache = None
+    _asset_index.cache_clear()
+    check_relation_exists.cache_clear()
+    list_profiles_once.cache_clear()
+    _credentials_cache.clear()
 
 def get_all_profiles():
-    """Get and display all available profiles for reference."""
-    print("\n📋 Available Asset Profiles:")
-    try:
-        url = f"{THINGSBOARD_URL}/api/assetProfiles"
-        params = {"pageSize": 100, "page": 0}
-        r = requests.get(url, headers=HEADERS, params=params)
-        r.raise_for_status()
-        
-        profiles = r.json().get("data", [])
+    """Display all available profiles for reference, from the list fetched at start-up."""
+    asset_profiles, device_profiles = list_profiles_once()
+    for title, profiles in (("Asset", asset_profiles), ("Device", device_profiles)):
+        log.info(f"\n📋 Available {title} Profiles:")
         for profile in profiles:
-            print(f"  - {profile['name']}")
-    except Exception as e:
-        print(f"  ❌ Error fetching asset profiles: {e}")
-    
-    print("\n📋 Available Device Profiles:")
-    try:
-        url = f"{THINGSBOARD_URL}/api/deviceProfiles"
-        params = {"pageSize": 100, "page": 0}
-        r = requests.get(url, headers=HEADERS, params=params)
-        r.raise_for_status()
-        
-        profiles = r.json().get("data", [])
-        for profile in profiles:
-            print(f"  - {profile['name']}")
-    except Exception as e:
-        print(f"  ❌ Error fetching device profiles: {e}")
-    print()
+            log.info(f"  - {profile['name']}")
+    log.info("")
 
 # ---- Execution ----
 
-# Step 0: Validate Token First
-print("Validating JWT token...")
-if not validate_token():
-    print("❌ Script stopped due to token validation failure")
-    print("\n🔧 To fix this:")
-    print("1. Get a fresh JWT token from ThingsBoard login")
-    print("2. Replace the JWT_TOKEN variable with the new token")
-    print("3. Ensure your user has TENANT_ADMIN permissions")
-    exit(1)
-
-print(f"🚀 Starting device provisioning for: {DEVICE_NAME}")
-
-# Step 0.1: List all existing assets for debugging
-list_all_assets()
-
-# Step 0.5: Fetch Profile IDs dynamically
-print("🔍 Fetching profile IDs...")
-country_profile_id = get_asset_profile_id_by_name(COUNTRY_PROFILE_NAME)
-state_profile_id = get_asset_profile_id_by_name(STATE_PROFILE_NAME)
-device_profile_id = get_device_profile_id_by_name(DEVICE_PROFILE_NAME)
-
-if not country_profile_id:
-    print(f"❌ Country profile '{COUNTRY_PROFILE_NAME}' not found!")
-    get_all_profiles()
-    print("Please update COUNTRY_PROFILE_NAME with the correct profile name from above list")
-    exit(1)
-
-if not state_profile_id:
-    print(f"❌ State profile '{STATE_PROFILE_NAME}' not found!")
-    get_all_profiles()
-    print("Please update STATE_PROFILE_NAME with the correct profile name from above list")
-    exit(1)
-
-if not device_profile_id:
-    print(f"❌ Device profile '{DEVICE_PROFILE_NAME}' not found!")
-    get_all_profiles()
-    print("Please update DEVICE_PROFILE_NAME with the correct profile name from above list")
-    exit(1)
-
-print(f"✅ Found Country profile: {COUNTRY_PROFILE_NAME}")
-print(f"✅ Found State profile: {STATE_PROFILE_NAME}")
-print(f"✅ Found Device profile: {DEVICE_PROFILE_NAME}")
-
-# Step 1: Handle Country Asset - Search by name regardless of type
-print("Checking if country asset exists...")
-country_asset = None
-all_assets = list_all_assets()
-
-# Find country asset by name (any type)
-for asset in all_assets:
-    if asset['name'].upper() == COUNTRY_NAME.upper():
-        country_asset = asset
-        print(f"✅ Found country asset: '{asset['name']}' (Type: {asset['type']})")
-        break
-
-if not country_asset:
-    print(f"❌ Country asset '{COUNTRY_NAME}' not found!")
-    print("🔧 Available countries in your ThingsBoard:")
-    country_like_assets = [asset for asset in all_assets if any(keyword in asset['name'].upper() for keyword in ['COUNTRY', 'NATION', COUNTRY_NAME.upper()[:3]])]
-    for asset in country_like_assets:
-        print(f"  - {asset['name']} ({asset['type']})")
+def main(argv=None):
+    """Provision this machine as a ThingsBoard device.
+
+    Safe to call repeatedly in one process; later calls reuse the pooled
+    session and profile lookups, but re-read the asset list.
+    """
+    global CFG, LAT, LON, DEVICE_NAME
+    args = parser.parse_args(argv)
     
-    # Try to create the country asset automatically
-    print(f"\n🔄 Attempting to create country asset '{COUNTRY_NAME}' automatically...")
-    try:
-        # Create the country asset using the profile from config
-        country_asset = create_asset(COUNTRY_NAME, country_profile_id, COUNTRY_PROFILE_NAME)
-        print(f"✅ Successfully created country asset '{COUNTRY_NAME}'")
-        
-        # Add coordinates to the new country asset (using detected location)
-        send_asset_attributes("ASSET", country_asset["id"]["id"], LAT, LON)
-        
-    except Exception as e:
-        print(f"❌ Failed to create country asset: {e}")
-        print("\nManual Solutions:")
-        print("1. Create the country asset manually in ThingsBoard UI")
-        print("2. Or delete some unused assets to free up space")
-        print("3. Or update the country name in config.properties to match existing assets")
+    # Progress messages go through logging; LOGLEVEL=WARNING silences them,
+    # PROVISION_DEBUG (or LOGLEVEL=DEBUG) adds asset dumps and candidate matches
+    default_level = 'DEBUG' if os.environ.get('PROVISION_DEBUG') else 'INFO'
+    level = os.environ.get('LOGLEVEL', default_level).upper()
+    known_level = level in logging.getLevelNamesMapping()
+    logging.basicConfig(level=level if known_level else default_level, format='%(message)s')
+    if not known_level:
+        log.warning(f"⚠️ Unknown LOGLEVEL '{level}', using {default_level}")
+    
+    CFG = load_config()
+    _session().headers["X-Authorization"] = f"Bearer {CFG.jwt_token}"
+    LAT, LON = resolve_coordinates(refresh=args.refresh_geo)
+    # Always use config values for country and state names
+    log.info(f"✅ Using config values - Country: {CFG.country_name}, State: {CFG.state_name}")
+    DEVICE_NAME = generate_device_name(CFG.country_name, CFG.state_name)
+
+    # Step 0: Validate Token First
+    log.info("Validating JWT token...")
+    if not validate_token():
+        log.error("❌ Script stopped due to token validation failure")
+        log.error("\n🔧 To fix this:")
+        log.error("1. Get a fresh JWT token from ThingsBoard login")
+        log.error("2. Update jwt_token in config.properties with the new token")
+        log.error("3. Ensure your user has TENANT_ADMIN permissions")
+        exit(1)
+
+    log.info(f"🚀 Starting device provisioning for: {DEVICE_NAME}")
+
+    # Step 0.1: Fetch all existing assets once; the country/state searches below reuse this list.
+    # Refresh it so a repeat call sees assets created by the previous one.
+    all_assets = fetch_all_assets(refresh=True)
+    if log.isEnabledFor(logging.DEBUG):
+        log_assets(all_assets)
+    assets_by_folded_name = asset_name_index()
+
+    # Step 0.5: Fetch Profile IDs dynamically
+    log.info("🔍 Fetching profile IDs...")
+    # The first lookup fetches both profile lists once; the rest, and the error listing, reuse them
+    country_profile_id = get_asset_profile_id_by_name(CFG.country_profile_name)
+    state_profile_id = get_asset_profile_id_by_name(CFG.state_profile_name)
+    device_profile_id = get_device_profile_id_by_name(CFG.device_profile_name)
+
+    if not country_profile_id:
+        log.error(f"❌ Country profile '{CFG.country_profile_name}' not found!")
+        get_all_profiles()
+        log.info("Please update country_profile_name in config.properties with the correct profile name from above list")
+        exit(1)
+
+    if not state_profile_id:
+        log.error(f"❌ State profile '{CFG.state_profile_name}' not found!")
+        get_all_profiles()
+        log.info("Please update state_profile_name in config.properties with the correct profile name from above list")
+        exit(1)
+
+    if not device_profile_id:
+        log.error(f"❌ Device profile '{CFG.device_profile_name}' not found!")
+        get_all_profiles()
+        log.info("Please update device_profile_name in config.properties with the correct profile name from above list")
         exit(1)
 
-# Step 2: Handle State Asset - Search by name regardless of type
-print("Checking if state asset exists...")
-state_asset = None
-
-# Find state asset by name (any type)
-for asset in all_assets:
-    if asset['name'].upper() == STATE_NAME.upper():
-        state_asset = asset
-        print(f"✅ Found state asset: '{asset['name']}' (Type: {asset['type']})")
-        break
-
-if not state_asset:
-    print(f"❌ State asset '{STATE_NAME}' not found!")
-    print("🔧 Available states/regions in your ThingsBoard:")
-    state_like_assets = [asset for asset in all_assets if any(keyword in asset['name'].upper() for keyword in ['STATE', 'REGION', 'PROVINCE', STATE_NAME.upper()[:3]])]
-    for asset in state_like_assets:
-        print(f"  - {asset['name']} ({asset['type']})")
+    log.info(f"✅ Found Country profile: {CFG.country_profile_name}")
+    log.info(f"✅ Found State profile: {CFG.state_profile_name}")
+    log.info(f"✅ Found Device profile: {CFG.device_profile_name}")
+
+    # Step 1: Handle Country Asset - Search by name regardless of type
+    log.info("Checking if country asset exists...")
+    country_asset = None
+
+    # Find country asset by name (any type)
+    country_matches = assets_by_folded_name.get(CFG.country_name.casefold())
+    if country_matches:
+        country_asset = country_matches[0]
+        log.info(f"✅ Found country asset: '{country_asset['name']}' (Type: {country_asset['type']})")
+
+    if not country_asset:
+        log.error(f"❌ Country asset '{CFG.country_name}' not found!")
+        log.info("🔧 Available countries in your ThingsBoard:")
+        keywords = ('country', 'nation', CFG.country_name.casefold()[:3])
+        country_like_assets = [asset for asset in all_assets if any(keyword in asset['name'].casefold() for keyword in keywords)]
+        for asset in country_like_assets:
+            log.info(f"  - {asset['name']} ({asset['type']})")
     
-    # Try to create the state asset automatically
-    print(f"\n🔄 Attempting to create state asset '{STATE_NAME}' automatically...")
-    try:
-        # Create the state asset using the profile from config
-        state_asset = create_asset(STATE_NAME, state_profile_id, STATE_PROFILE_NAME)
-        print(f"✅ Successfully created state asset '{STATE_NAME}'")
+        # Try to create the country asset automatically
+        log.info(f"\n🔄 Attempting to create country asset '{CFG.country_name}' automatically...")
+        try:
+            # Create the country asset using the profile from config, with the detected coordinates
+            country_asset = create_asset_with_attributes(CFG.country_name, country_profile_id, CFG.country_profile_name, LAT, LON)
+            log.info(f"✅ Successfully created country asset '{CFG.country_name}'")
         
-        # Add coordinates to the new state asset (using detected location)
-        send_asset_attributes("ASSET", state_asset["id"]["id"], LAT, LON)
+        except Exception as e:
+            log.error(f"❌ Failed to create country asset: {e}")
+            log.info("\nManual Solutions:")
+            log.info("1. Create the country asset manually in ThingsBoard UI")
+            log.info("2. Or delete some unused assets to free up space")
+            log.info("3. Or update the country name in config.properties to match existing assets")
+            exit(1)
+
+    # Step 2: Handle State Asset - Search by name regardless of type
+    log.info("Checking if state asset exists...")
+    state_asset = None
+    state_created = False
+
+    # Find state asset by name (any type)
+    state_matches = assets_by_folded_name.get(CFG.state_name.casefold())
+    if state_matches:
+        state_asset = state_matches[0]
+        log.info(f"✅ Found state asset: '{state_asset['name']}' (Type: {state_asset['type']})")
+
+    if not state_asset:
+        log.error(f"❌ State asset '{CFG.state_name}' not found!")
+        log.info("🔧 Available states/regions in your ThingsBoard:")
+        keywords = ('state', 'region', 'province', CFG.state_name.casefold()[:3])
+        state_like_assets = [asset for asset in all_assets if any(keyword in asset['name'].casefold() for keyword in keywords)]
+        for asset in state_like_assets:
+            log.info(f"  - {asset['name']} ({asset['type']})")
+    
+        # Try to create the state asset automatically
+        log.info(f"\n🔄 Attempting to create state asset '{CFG.state_name}' automatically...")
+        try:
+            # Create the state asset using the profile from config, with the detected
+            # coordinates, and link it to the country in the same step
+            state_asset = create_asset_with_attributes(CFG.state_name, state_profile_id, CFG.state_profile_name, LAT, LON,
+                                                       parent_id=country_asset["id"]["id"])
+            state_created = True
+            log.info(f"✅ Successfully created state asset '{CFG.state_name}' and linked it to country")
         
-    except Exception as e:
-        print(f"❌ Failed to create state asset: {e}")
-        print("\nManual Solutions:")
-        print("1. Create the state asset manually in ThingsBoard UI")
-        print("2. Or delete some unused assets to free up space")
-        print("3. Or update the state name in config.properties to match existing assets")
-        exit(1)
-
-# Step 3: Link State to Country (if not already linked)
-print("Checking state-country relationship...")
-if not check_relation_exists(country_asset["id"]["id"], state_asset["id"]["id"]):
-    print("Linking state to country...")
-    assign_child_asset(country_asset["id"]["id"], state_asset["id"]["id"])
-    print("✅ Linked state to country")
-else:
-    print("✅ State already linked to country")
-
-# Step 4: Create Device (always create new device)
-print(f"Creating device '{DEVICE_NAME}'...")
-device = create_device(DEVICE_NAME, device_profile_id)
-print(f"✅ Created device '{DEVICE_NAME}'")
-
-# Step 5: Link Device to State
-print("Linking device to state...")
-assign_device_to_asset(device["id"]["id"], state_asset["id"]["id"])
-print("✅ Linked device to state")
-
-# Step 6: Get Device Credentials and Send Telemetry
-print("Getting device token...")
-device_token = get_device_credentials(device["id"]["id"])
-
-print("Sending telemetry...")
-send_telemetry(device_token)
-
-print("✅ All done! Device provisioned successfully.")
+        except Exception as e:
+            log.error(f"❌ Failed to create state asset: {e}")
+            log.info("\nManual Solutions:")
+            log.info("1. Create the state asset manually in ThingsBoard UI")
+            log.info("2. Or delete some unused assets to free up space")
+            log.info("3. Or update the state name in config.properties to match existing assets")
+            exit(1)
+
+    # Step 3: Link State to Country (if not already linked)
+    log.info("Checking state-country relationship...")
+    if state_created:
+        log.info("✅ State linked to country on creation")
+    elif not check_relation_exists(country_asset["id"]["id"], state_asset["id"]["id"]):
+        log.info("Linking state to country...")
+        assign_child_asset(country_asset["id"]["id"], state_asset["id"]["id"])
+        log.info("✅ Linked state to country")
+    else:
+        log.info("✅ State already linked to country")
+
+    # Step 4: Create Device (always create new device)
+    log.info(f"Creating device '{DEVICE_NAME}'...")
+    device = create_device(DEVICE_NAME, device_profile_id)
+    log.info(f"✅ Created device '{DEVICE_NAME}'")
+
+    # Step 5: Link Device to State
+    log.info("Linking device to state...")
+    assign_device_to_asset(device["id"]["id"], state_asset["id"]["id"])
+    log.info("✅ Linked device to state")
+
+    # Step 6: Get Device Credentials and Send Telemetry
+    log.info("Getting device token...")
+    device_token = get_device_credentials(device["id"]["id"])
+
+    log.info("Sending telemetry...")
+    send_telemetry(device_token)
+
+    log.info("✅ All done! Device provisioned successfully.")
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,66 @@
 import psycopg2
-from psycopg2.extras import execute_values
 import requests
-import json
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import io
 import configparser
 import os
+import re
+import functools
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser(description="Copy ThingsBoard assets and devices into the database.")
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument('--yes', action='store_true',
+                   help="Save without asking for confirmation")
+mode.add_argument('--dry-run', action='store_true',
+                   help="Fetch and show what would be saved, then stop")
+
 # Database connection configuration will be loaded from config.properties
 DB_CONFIG = {}
 
+# Concurrent ThingsBoard requests when fetching per-entity attributes or relations
+ATTRIBUTE_FETCH_WORKERS = 32
+# Concurrent ThingsBoard requests when fetching the remaining pages of a list
+PAGE_FETCH_WORKERS = 16
+# Entities per /api/entitiesQuery/find request
+ENTITY_QUERY_CHUNK = 100
+
+# Shared keep-alive session for all ThingsBoard calls; the JWT is added by authorize_session()
+SESSION = requests.Session()
+SESSION.headers.update({"Content-Type": "application/json"})
+# ThingsBoard is often served over plain http (e.g. :8080), so pool both schemes;
+# the default adapter keeps only 10 connections, fewer than the fetch workers
+_ADAPTER = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3)
+)
+SESSION.mount("https://", _ADAPTER)
+SESSION.mount("http://", _ADAPTER)
+
+@functools.lru_cache(maxsize=1)
 def load_config():
-    """Load configuration from config.properties file."""
+    """Load configuration from config.properties file (parsed once per process)."""
     config = configparser.ConfigParser()
     config_file = 'config.properties'
     
     if not os.path.exists(config_file):
-        print(f"❌ Configuration file '{config_file}' not found!")
+        logger.error(f"❌ Configuration file '{config_file}' not found!")
         exit(1)
     
     try:
         config.read(config_file)
-        print(f"✅ Loaded configuration from {config_file}")
+        logger.info(f"✅ Loaded configuration from {config_file}")
         return config
     except Exception as e:
-        print(f"❌ Error reading configuration file: {e}")
+        logger.error(f"❌ Error reading configuration file: {e}")
         exit(1)
 
 def load_db_config(config):
@@ -39,10 +76,10 @@ def load_db_config(config):
             "port": config.getint('database', 'port', fallback=5432),
             "options": config.get('database', 'options', fallback='-c search_path=papaya_parking_db')
         }
-        print(f"✅ Loaded database configuration: {DB_CONFIG['user']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}")
+        logger.info(f"✅ Loaded database configuration: {DB_CONFIG['user']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}")
     except Exception as e:
-        print(f"❌ Error loading database configuration: {e}")
-        print("Using default database configuration...")
+        logger.error(f"❌ Error loading database configuration: {e}")
+        logger.info("Using default database configuration...")
         DB_CONFIG = {
             "dbname": "postgres",
             "user": "myuser",
@@ -56,273 +93,275 @@ def connect_to_db():
     """Establish a connection to the PostgreSQL database."""
     try:
         conn = psycopg2.connect(**DB_CONFIG)
-        print("✅ Connected to the database.")
+        logger.info("✅ Connected to the database.")
         return conn
     except Exception as e:
-        print(f"❌ Failed to connect to the database: {e}")
+        logger.error(f"❌ Failed to connect to the database: {e}")
         exit(1)
 
-def validate_token(thingsboard_url, headers):
-    """Validate JWT token by checking user info."""
-    try:
-        url = f"{thingsboard_url}/api/auth/user"
-        r = requests.get(url, headers=headers)
-        if r.status_code == 200:
-            user_info = r.json()
-            print(f"✅ Token valid - User: {user_info.get('firstName', '')} {user_info.get('lastName', '')}")
-            return True
-        elif r.status_code == 401:
-            print("❌ Token expired or invalid")
-            return False
-        elif r.status_code == 403:
-            print("❌ Token lacks permissions")
-            return False
-        else:
-            print(f"❌ Token validation failed: {r.status_code}")
-            return False
-    except Exception as e:
-        print(f"❌ Token validation error: {e}")
-        return False
+def _json(r):
+    """Decode a response body with orjson."""
+    return orjson.loads(r.content)
+
+def authorize_session(config):
+    """Send the configured JWT with every request on SESSION."""
+    SESSION.headers["X-Authorization"] = f"Bearer {config.get('thingsboard', 'jwt_token')}"
 
-def fetch_thingsboard_assets():
-    """Fetch all assets from ThingsBoard API."""
+@functools.lru_cache(maxsize=1)
+def get_tb_client():
+    """Return (thingsboard_url, session), with the session authorized from config.properties."""
     config = load_config()
+    authorize_session(config)
+    return config.get('thingsboard', 'url'), SESSION
+
+def fetch_remaining_pages(url, params, first_page):
+    """Return the "data" of every page of a paged ThingsBoard list.
+
+    first_page is the decoded body of page 0, already checked by the caller;
+    its totalPages decides how many more pages are fetched, concurrently.
+    """
+    data = list(first_page.get("data", []))
+    total_pages = first_page.get("totalPages", 1)
+    if total_pages <= 1:
+        return data
+    
+    def fetch_page(page):
+        r = SESSION.get(url, params={**params, "page": page})
+        r.raise_for_status()
+        return _json(r).get("data", [])
     
-    THINGSBOARD_URL = config.get('thingsboard', 'url')
-    JWT_TOKEN = config.get('thingsboard', 'jwt_token')
-    HEADERS = {
-        "Content-Type": "application/json",
-        "X-Authorization": f"Bearer {JWT_TOKEN}"
-    }
-    
-    # Validate token first
-    print("🔐 Validating JWT token...")
-    if not validate_token(THINGSBOARD_URL, HEADERS):
-        print("❌ Token validation failed. Please check your JWT token in config.properties")
-        print("\n🔧 To fix this:")
-        print("1. Login to ThingsBoard web interface")
-        print("2. Open browser developer tools (F12)")
-        print("3. Go to Network tab and refresh the page")
-        print("4. Look for any API request and copy the 'X-Authorization' header value")
-        print("5. Update the jwt_token in config.properties (remove 'Bearer ' prefix)")
-        return []
-    
-    print("🔍 Fetching all assets from ThingsBoard...")
+    with ThreadPoolExecutor(max_workers=PAGE_FETCH_WORKERS) as executor:
+        for page_data in executor.map(fetch_page, range(1, total_pages)):
+            data.extend(page_data)
+    return data
+
+def fetch_thingsboard_assets(thingsboard_url):
+    """Fetch all assets from ThingsBoard API.
+
+    This is the first ThingsBoard call of a run, so its status code doubles as
+    the JWT check.
+    """
+    logger.info("🔍 Fetching all assets from ThingsBoard...")
     try:
-        url = f"{THINGSBOARD_URL}/api/tenant/assets"
+        url = f"{thingsboard_url}/api/tenant/assets"
         params = {
             "pageSize": 1000,
             "page": 0,
             "sortProperty": "name",
             "sortOrder": "ASC"
         }
-        r = requests.get(url, headers=HEADERS, params=params)
+        r = SESSION.get(url, params=params)
         
         if r.status_code == 401:
-            print("❌ 401 Unauthorized - Token expired or invalid")
-            print("Please update your JWT token in config.properties")
+            logger.error("❌ 401 Unauthorized - Token expired or invalid")
+            # The fix steps are part of the error, so they show at any LOGLEVEL that shows it
+            logger.error("Please check your JWT token in config.properties")
+            logger.error("\n🔧 To fix this:")
+            logger.error("1. Login to ThingsBoard web interface")
+            logger.error("2. Open browser developer tools (F12)")
+            logger.error("3. Go to Network tab and refresh the page")
+            logger.error("4. Look for any API request and copy the 'X-Authorization' header value")
+            logger.error("5. Update the jwt_token in config.properties (remove 'Bearer ' prefix)")
             return []
         elif r.status_code == 403:
-            print("❌ 403 Forbidden - Insufficient permissions")
-            print("Make sure your user has TENANT_ADMIN permissions")
+            logger.error("❌ 403 Forbidden - Insufficient permissions")
+            logger.error("Make sure your user has TENANT_ADMIN permissions")
             return []
         
         r.raise_for_status()
         
-        assets = r.json().get("data", [])
-        print(f"📊 Found {len(assets)} total assets")
+        assets = fetch_remaining_pages(url, params, _json(r))
+        logger.info(f"📊 Found {len(assets)} total assets")
         return assets
     except requests.exceptions.HTTPError as e:
-        print(f"❌ HTTP Error fetching assets: {e}")
-        print(f"Response: {r.text}")
+        logger.error(f"❌ HTTP Error fetching assets: {e}")
+        logger.info(f"Response: {r.text}")
         return []
     except Exception as e:
-        print(f"❌ Error fetching assets: {e}")
+        logger.error(f"❌ Error fetching assets: {e}")
         return []
 
-def fetch_thingsboard_devices():
+def fetch_thingsboard_devices(thingsboard_url):
     """Fetch all devices from ThingsBoard API."""
-    config = load_config()
-    
-    THINGSBOARD_URL = config.get('thingsboard', 'url')
-    JWT_TOKEN = config.get('thingsboard', 'jwt_token')
-    HEADERS = {
-        "Content-Type": "application/json",
-        "X-Authorization": f"Bearer {JWT_TOKEN}"
-    }
-    
-    print("🔍 Fetching all devices from ThingsBoard...")
+    logger.info("🔍 Fetching all devices from ThingsBoard...")
     try:
-        url = f"{THINGSBOARD_URL}/api/tenant/devices"
+        url = f"{thingsboard_url}/api/tenant/devices"
         params = {
             "pageSize": 1000,
             "page": 0,
             "sortProperty": "name",
             "sortOrder": "ASC"
         }
-        r = requests.get(url, headers=HEADERS, params=params)
+        r = SESSION.get(url, params=params)
         
         if r.status_code == 401:
-            print("❌ 401 Unauthorized - Token expired or invalid")
+            logger.error("❌ 401 Unauthorized - Token expired or invalid")
             return []
         elif r.status_code == 403:
-            print("❌ 403 Forbidden - Insufficient permissions")
+            logger.error("❌ 403 Forbidden - Insufficient permissions")
             return []
         
         r.raise_for_status()
         
-        devices = r.json().get("data", [])
-        print(f"📊 Found {len(devices)} total devices")
+        devices = fetch_remaining_pages(url, params, _json(r))
+        logger.info(f"📊 Found {len(devices)} total devices")
         return devices
     except requests.exceptions.HTTPError as e:
-        print(f"❌ HTTP Error fetching devices: {e}")
-        print(f"Response: {r.text}")
+        logger.error(f"❌ HTTP Error fetching devices: {e}")
+        logger.info(f"Response: {r.text}")
         return []
     except Exception as e:
-        print(f"❌ Error fetching devices: {e}")
+        logger.error(f"❌ Error fetching devices: {e}")
         return []
 
+# Fallback categorization for assets that don't match the configured profiles
+FALLBACK_COUNTRY_TYPE_RE = re.compile('country|nation|territory')
+FALLBACK_STATE_TYPE_RE = re.compile('state|province|region|territory|district')
+# Name patterns, as a last resort
+COUNTRY_NAME_RE = re.compile('COUNTRY|NATION')
+STATE_NAME_RE = re.compile('STATE|PROVINCE|REGION')
+
+def _fallback_bucket(asset_type, asset_name):
+    """Return 'country', 'state' or 'device' for an asset whose type matches no configured profile."""
+    if FALLBACK_COUNTRY_TYPE_RE.search(asset_type):
+        return 'country'
+    if FALLBACK_STATE_TYPE_RE.search(asset_type):
+        return 'state'
+    upper_name = asset_name.upper()
+    if len(asset_name) <= 3 or COUNTRY_NAME_RE.search(upper_name):
+        return 'country'
+    if STATE_NAME_RE.search(upper_name):
+        return 'state'
+    return 'device'
+
 def categorize_assets(assets, config):
     """Categorize assets into countries and states based on profile names from config."""
-    countries = []
-    states = []
-    devices = []
+    buckets = {'country': [], 'state': [], 'device': []}
     
     # Get profile names from config
     country_profile_name = config.get('profiles', 'country_profile_name').lower()
     state_profile_name = config.get('profiles', 'state_profile_name').lower()
     device_profile_name = config.get('profiles', 'device_profile_name').lower()
     
-    print(f"🔍 Looking for assets with profiles:")
-    print(f"  - Country profile: {country_profile_name}")
-    print(f"  - State profile: {state_profile_name}")
-    print(f"  - Device profile: {device_profile_name}")
+    logger.info(f"🔍 Looking for assets with profiles:")
+    logger.info(f"  - Country profile: {country_profile_name}")
+    logger.info(f"  - State profile: {state_profile_name}")
+    logger.info(f"  - Device profile: {device_profile_name}")
+    
+    # Exact profile type -> bucket; built in reverse so country wins if names collide
+    profile_buckets = {
+        device_profile_name: 'device',
+        state_profile_name: 'state',
+        country_profile_name: 'country',
+    }
+    debug = logger.isEnabledFor(logging.DEBUG)
     
     for asset in assets:
         asset_type = asset.get('type', '').lower()
-        asset_name = asset.get('name', '')
-        
-        # Categorize based on exact profile type match
-        if asset_type == country_profile_name:
-            countries.append(asset)
-            print(f"  ✅ Found country asset: {asset_name} (Type: {asset_type})")
-        elif asset_type == state_profile_name:
-            states.append(asset)
-            print(f"  ✅ Found state asset: {asset_name} (Type: {asset_type})")
-        elif asset_type == device_profile_name:
-            devices.append(asset)
-            print(f"  ✅ Found device asset: {asset_name} (Type: {asset_type})")
-        else:
-            # Fallback categorization for assets that don't match exact profiles
-            country_types = ['country', 'nation', 'territory']
-            state_types = ['state', 'province', 'region', 'territory', 'district']
-            
-            if any(ct in asset_type for ct in country_types):
-                countries.append(asset)
-                print(f"  📍 Fallback country asset: {asset_name} (Type: {asset_type})")
-            elif any(st in asset_type for st in state_types):
-                states.append(asset)
-                print(f"  📍 Fallback state asset: {asset_name} (Type: {asset_type})")
-            else:
-                # Check by name patterns as last resort
-                if len(asset_name) <= 3 or any(keyword in asset_name.upper() for keyword in ['COUNTRY', 'NATION']):
-                    countries.append(asset)
-                    print(f"  🔤 Name-based country asset: {asset_name} (Type: {asset_type})")
-                elif any(keyword in asset_name.upper() for keyword in ['STATE', 'PROVINCE', 'REGION']):
-                    states.append(asset)
-                    print(f"  🔤 Name-based state asset: {asset_name} (Type: {asset_type})")
-                else:
-                    devices.append(asset)
-                    print(f"  ❓ Other asset (treated as device): {asset_name} (Type: {asset_type})")
-    
-    print(f"📋 Categorized: {len(countries)} countries, {len(states)} states, {len(devices)} other assets")
+        bucket = profile_buckets.get(asset_type)
+        if bucket is None:
+            bucket = _fallback_bucket(asset_type, asset.get('name', ''))
+            if debug:
+                logger.debug(f"  📍 Fallback {bucket} asset: {asset.get('name', '')} (Type: {asset_type})")
+        elif debug:
+            logger.debug(f"  ✅ Found {bucket} asset: {asset.get('name', '')} (Type: {asset_type})")
+        buckets[bucket].append(asset)
+    
+    countries, states, devices = buckets['country'], buckets['state'], buckets['device']
+    logger.info(f"📋 Categorized: {len(countries)} countries, {len(states)} states, {len(devices)} other assets")
     return countries, states, devices
 
-def save_countries_to_db(countries):
-    """Save country assets to database."""
+def save_countries_to_db(conn, countries, now):
+    """Save country assets to database, stamped with created_at=now."""
     if not countries:
-        print("ℹ️ No countries to save")
+        logger.info("ℹ️ No countries to save")
         return {}
     
-    conn = connect_to_db()
     country_mapping = {}
     
     try:
         with conn.cursor() as cur:
+            # One row per name: a single upsert statement can't touch the same row twice
+            tb_ids_by_name = {}
             for country in countries:
-                country_name = country['name']
-                
-                # Insert country with conflict handling
-                cur.execute("""
-                    INSERT INTO country_asset (country_name, created_at)
-                    VALUES (%s, %s)
-                    ON CONFLICT (country_name) DO UPDATE SET
-                        country_name = EXCLUDED.country_name
-                    RETURNING country_id;
-                """, (country_name, datetime.now()))
-                
-                result = cur.fetchone()
-                if result:
-                    country_id = result[0]
-                    country_mapping[country['id']['id']] = {
+                tb_ids_by_name.setdefault(country['name'], []).append(country['id']['id'])
+            
+            # Insert all countries in one statement with conflict handling; the names
+            # go over as a single array parameter, so the SQL text doesn't grow with N
+            cur.execute("""
+                INSERT INTO country_asset (country_name, created_at)
+                SELECT country_name, %s FROM UNNEST(%s::text[]) AS country_name
+                ON CONFLICT (country_name) DO UPDATE SET
+                    country_name = EXCLUDED.country_name
+                RETURNING country_id, country_name;
+            """, (now, list(tb_ids_by_name)))
+            
+            for country_id, country_name in cur.fetchall():
+                for tb_id in tb_ids_by_name[country_name]:
+                    country_mapping[tb_id] = {
                         'db_id': country_id,
                         'name': country_name
                     }
-                    print(f"✅ Saved country: {country_name} (ID: {country_id})")
+                logger.debug("✅ Saved country: %s (ID: %s)", country_name, country_id)
             
             conn.commit()
-            print(f"✅ Successfully saved {len(countries)} countries")
+            logger.info(f"✅ Successfully saved {len(countries)} countries")
             
     except Exception as e:
-        print(f"❌ Error saving countries: {e}")
+        logger.error(f"❌ Error saving countries: {e}")
         conn.rollback()
-    finally:
-        conn.close()
     
     return country_mapping
 
-def get_asset_relations(thingsboard_url, headers):
-    """Fetch all asset relations from ThingsBoard to find state-country connections."""
-    print("🔗 Fetching asset relations from ThingsBoard...")
+def _fetch_contained_assets(country_id, thingsboard_url):
+    """Return the ids of assets a country directly Contains."""
+    query = {
+        "parameters": {
+            "rootId": country_id,
+            "rootType": "ASSET",
+            "direction": "FROM",
+            "relationTypeGroup": "COMMON",
+            "maxLevel": 1
+        },
+        "filters": [{"relationType": "Contains", "entityTypes": ["ASSET"]}]
+    }
+    r = SESSION.post(f"{thingsboard_url}/api/relations", data=orjson.dumps(query))
+    r.raise_for_status()
+    return [relation["to"]["id"] for relation in _json(r)]
+
+def get_asset_relations(thingsboard_url, countries):
+    """Fetch the asset relations under each country to find state-country connections.
+
+    Returns {child asset id: country id}. Only asset-to-asset Contains relations
+    from the given countries are requested; the countries are queried concurrently.
+    """
+    logger.info("🔗 Fetching asset relations from ThingsBoard...")
     relations = {}
+    country_ids = [country['id']['id'] for country in countries]
     
-    try:
-        # Get all relations - this might need pagination for large datasets
-        url = f"{thingsboard_url}/api/relations"
-        params = {
-            "pageSize": 1000,
-            "page": 0
-        }
-        r = requests.get(url, headers=headers, params=params)
-        
-        if r.status_code == 200:
-            relations_data = r.json().get("data", [])
-            print(f"📊 Found {len(relations_data)} total relations")
-            
-            for relation in relations_data:
-                # Look for "Contains" relations between assets
-                if (relation.get("type") == "Contains" and 
-                    relation.get("from", {}).get("entityType") == "ASSET" and 
-                    relation.get("to", {}).get("entityType") == "ASSET"):
-                    
-                    parent_id = relation["from"]["id"]
-                    child_id = relation["to"]["id"]
-                    relations[child_id] = parent_id
-                    
-            print(f"🔗 Found {len(relations)} asset parent-child relations")
-        else:
-            print(f"⚠️ Could not fetch relations: {r.status_code}")
-            
-    except Exception as e:
-        print(f"⚠️ Error fetching relations: {e}")
+    def fetch(country_id):
+        try:
+            return _fetch_contained_assets(country_id, thingsboard_url)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not fetch relations for country {country_id}: {e}")
+            return []
     
+    with ThreadPoolExecutor(max_workers=ATTRIBUTE_FETCH_WORKERS) as executor:
+        for country_id, child_ids in zip(country_ids, executor.map(fetch, country_ids)):
+            relations.update(dict.fromkeys(child_ids, country_id))
+    
+    logger.info(f"🔗 Found {len(relations)} asset parent-child relations")
     return relations
 
 def find_state_country_mapping(states, countries, relations):
-    """Find which states belong to which countries based on ThingsBoard relations."""
+    """Find which states belong to which countries based on ThingsBoard relations.
+
+    relations holds only children of the categorized countries (see get_asset_relations),
+    so a state is either under one of those countries or gets no mapping.
+    """
     state_country_map = {}
     
-    print("🔍 Mapping states to countries based on relations...")
+    logger.info("🔍 Mapping states to countries based on relations...")
     
     # Create lookup dictionaries
     country_lookup = {country['id']['id']: country for country in countries}
@@ -332,430 +371,443 @@ def find_state_country_mapping(states, countries, relations):
         state_id = state['id']['id']
         state_name = state['name']
         
-        # Check if this state has a parent relation
-        if state_id in relations:
-            parent_id = relations[state_id]
-            
-            # Check if the parent is a country
-            if parent_id in country_lookup:
-                country = country_lookup[parent_id]
-                state_country_map[state_id] = parent_id
-                print(f"  ✅ Found relation: {state_name} → {country['name']}")
-            else:
-                print(f"  ⚠️ State {state_name} has parent but it's not a country")
+        parent_id = relations.get(state_id)
+        if parent_id in country_lookup:
+            state_country_map[state_id] = parent_id
+            logger.debug("  ✅ Found relation: %s → %s", state_name, country_lookup[parent_id]['name'])
         else:
-            print(f"  ❓ No parent relation found for state: {state_name}")
+            logger.debug("  ❓ No country relation found for state: %s", state_name)
     
     return state_country_map
 
-def save_states_to_db(states, country_mapping, state_country_relations):
-    """Save state assets to database with proper country relationships."""
+def save_states_to_db(conn, states, country_mapping, state_country_relations, now):
+    """Save state assets to database with proper country relationships, stamped with created_at=now."""
     if not states:
-        print("ℹ️ No states to save")
+        logger.info("ℹ️ No states to save")
         return {}
     
-    conn = connect_to_db()
     state_mapping = {}
     
     try:
         with conn.cursor() as cur:
-            for state in states:
-                state_name = state['name']
-                state_tb_id = state['id']['id']
-                
-                # Find the correct country for this state
-                country_id = None
-                
-                if state_tb_id in state_country_relations:
-                    # Get the ThingsBoard country ID
-                    country_tb_id = state_country_relations[state_tb_id]
-                    
-                    # Find the corresponding database country ID
-                    if country_tb_id in country_mapping:
-                        country_id = country_mapping[country_tb_id]['db_id']
-                        country_name = country_mapping[country_tb_id]['name']
-                        print(f"  🔗 Mapping state '{state_name}' to country '{country_name}' (DB ID: {country_id})")
-                    else:
-                        print(f"  ⚠️ Country not found in mapping for state '{state_name}'")
-                
-                # Fallback to first available country or create default
-                if country_id is None:
-                    if country_mapping:
-                        default_country = list(country_mapping.values())[0]
-                        country_id = default_country['db_id']
-                        print(f"  📍 Using default country for state '{state_name}': {default_country['name']}")
-                    else:
-                        # Create a default country if none exists
-                        cur.execute("""
-                            INSERT INTO country_asset (country_name, created_at)
-                            VALUES (%s, %s)
-                            ON CONFLICT (country_name) DO UPDATE SET
-                                country_name = EXCLUDED.country_name
-                            RETURNING country_id;
-                        """, ('DEFAULT_COUNTRY', datetime.now()))
-                        country_id = cur.fetchone()[0]
-                        print(f"  🏗️ Created default country for state '{state_name}'")
-                
-                # Insert state with the correct country relationship
+            # States without a related country go to the first available country,
+            # or to a default country created for them
+            if country_mapping:
+                default_country = list(country_mapping.values())[0]
+                default_country_id = default_country['db_id']
+                logger.info(f"  📍 Unrelated states will use default country: {default_country['name']}")
+            else:
                 cur.execute("""
+                    INSERT INTO country_asset (country_name, created_at)
+                    VALUES (%s, %s)
+                    ON CONFLICT (country_name) DO UPDATE SET
+                        country_name = EXCLUDED.country_name
+                    RETURNING country_id;
+                """, ('DEFAULT_COUNTRY', now))
+                default_country_id = cur.fetchone()[0]
+                logger.info("  🏗️ Created default country for states")
+            
+            # Stage the states (with their ThingsBoard parent) and the country id mapping,
+            # then resolve each state's country and upsert them in one statement
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS stage_states (
+                    tb_id text, state_name text, country_tb_id text
+                ) ON COMMIT DROP;
+                CREATE TEMP TABLE IF NOT EXISTS stage_countries (
+                    tb_id text, country_id integer
+                ) ON COMMIT DROP;
+            """)
+            copy_rows(cur, 'stage_states', ('tb_id', 'state_name', 'country_tb_id'),
+                      ((state['id']['id'], state['name'], state_country_relations.get(state['id']['id']))
+                       for state in states))
+            copy_rows(cur, 'stage_countries', ('tb_id', 'country_id'),
+                      ((tb_id, country['db_id']) for tb_id, country in country_mapping.items()))
+            
+            cur.execute("""
+                WITH resolved AS (
+                    SELECT s.tb_id, s.state_name, COALESCE(c.country_id, %(default_country_id)s) AS country_id
+                    FROM stage_states s
+                    LEFT JOIN stage_countries c ON c.tb_id = s.country_tb_id
+                ), saved AS (
                     INSERT INTO state_asset (state_name, country_id, created_at)
-                    VALUES (%s, %s, %s)
+                    SELECT DISTINCT state_name, country_id, %(now)s::timestamp FROM resolved
                     ON CONFLICT (country_id, state_name) DO UPDATE SET
                         state_name = EXCLUDED.state_name
-                    RETURNING state_id;
-                """, (state_name, country_id, datetime.now()))
-                
-                result = cur.fetchone()
-                if result:
-                    state_id = result[0]
-                    state_mapping[state_tb_id] = {
-                        'db_id': state_id,
-                        'name': state_name,
-                        'country_id': country_id
-                    }
-                    print(f"✅ Saved state: {state_name} (ID: {state_id}) → Country ID: {country_id}")
+                    RETURNING state_id, state_name, country_id
+                )
+                SELECT r.tb_id, saved.state_id, saved.state_name, saved.country_id
+                FROM resolved r
+                JOIN saved ON saved.state_name = r.state_name AND saved.country_id = r.country_id;
+            """, {'default_country_id': default_country_id, 'now': now})
+            
+            for tb_id, state_id, state_name, country_id in cur.fetchall():
+                state_mapping[tb_id] = {
+                    'db_id': state_id,
+                    'name': state_name,
+                    'country_id': country_id
+                }
+                logger.debug("✅ Saved state: %s (ID: %s) → Country ID: %s", state_name, state_id, country_id)
             
             conn.commit()
-            print(f"✅ Successfully saved {len(states)} states with proper country relationships")
+            logger.info(f"✅ Successfully saved {len(states)} states with proper country relationships")
             
     except Exception as e:
-        print(f"❌ Error saving states: {e}")
+        logger.error(f"❌ Error saving states: {e}")
         conn.rollback()
-    finally:
-        conn.close()
     
     return state_mapping
 
-def get_asset_attributes(asset_id, thingsboard_url, headers):
-    """Fetch asset attributes (like coordinates) from ThingsBoard."""
+def _attribute_float(latest, key):
+    """Return a float attribute from an entity-data "latest" block, or None if unset."""
+    value = latest.get(key, {}).get('value')
+    return float(value) if value not in (None, '') else None
+
+def _fetch_asset_coordinates_chunk(asset_ids, thingsboard_url):
+    """Fetch latitude/longitude for up to ENTITY_QUERY_CHUNK assets with one entity-data query."""
+    coordinates = dict.fromkeys(asset_ids, (None, None))
     try:
-        url = f"{thingsboard_url}/api/plugins/telemetry/ASSET/{asset_id}/values/attributes/SERVER_SCOPE"
-        r = requests.get(url, headers=headers)
-        if r.status_code == 200:
-            attributes = r.json()
-            lat = None
-            lon = None
-            
-            for attr in attributes:
-                if attr['key'] == 'latitude':
-                    lat = float(attr['value'])
-                elif attr['key'] == 'longitude':
-                    lon = float(attr['value'])
-            
-            return lat, lon
-        return None, None
+        query = {
+            "entityFilter": {"type": "entityList", "entityType": "ASSET", "entityList": asset_ids},
+            "pageLink": {"page": 0, "pageSize": len(asset_ids)},
+            "latestValues": [
+                {"type": "SERVER_ATTRIBUTE", "key": "latitude"},
+                {"type": "SERVER_ATTRIBUTE", "key": "longitude"}
+            ]
+        }
+        r = SESSION.post(f"{thingsboard_url}/api/entitiesQuery/find", data=orjson.dumps(query))
+        r.raise_for_status()
+        for entity in _json(r).get("data", []):
+            latest = entity.get("latest", {}).get("SERVER_ATTRIBUTE", {})
+            coordinates[entity["entityId"]["id"]] = (_attribute_float(latest, 'latitude'),
+                                                     _attribute_float(latest, 'longitude'))
     except Exception as e:
-        print(f"⚠️ Could not fetch attributes for asset {asset_id}: {e}")
-        return None, None
+        logger.warning(f"⚠️ Could not fetch attributes for {len(asset_ids)} assets: {e}")
+    return coordinates
+
+def get_asset_coordinates(asset_ids, thingsboard_url):
+    """Fetch asset coordinates from ThingsBoard as {asset_id: (lat, lon)}.
+
+    Assets are queried ENTITY_QUERY_CHUNK at a time through the entity-data
+    query endpoint instead of one attributes request per asset.
+    """
+    chunks = [asset_ids[i:i + ENTITY_QUERY_CHUNK] for i in range(0, len(asset_ids), ENTITY_QUERY_CHUNK)]
+    coordinates = {}
+    with ThreadPoolExecutor(max_workers=ATTRIBUTE_FETCH_WORKERS) as executor:
+        for chunk_coordinates in executor.map(lambda chunk: _fetch_asset_coordinates_chunk(chunk, thingsboard_url), chunks):
+            coordinates.update(chunk_coordinates)
+    return coordinates
+
+# ThingsBoard attribute key -> field it fills in get_device_attributes()
+DEVICE_ATTRIBUTE_KEYS = {
+    'latitude': 'lat',
+    'longitude': 'lon',
+    'firmwareVersion': 'fw',
+    'firmware_version': 'fw',
+    'version': 'fw'
+}
+
+def _collect_device_attributes(attributes):
+    """Pick the known keys out of an attribute list in one pass, as {field: raw value}."""
+    fields = {}
+    for attr in attributes:
+        field = DEVICE_ATTRIBUTE_KEYS.get(attr['key'])
+        if field:
+            fields[field] = attr['value']
+    return fields
 
-def get_device_attributes(device_id, thingsboard_url, headers):
-    """Fetch device attributes (like coordinates, firmware version) from ThingsBoard."""
+def get_device_attributes(device_id, thingsboard_url):
+    """Fetch device attributes (like coordinates, firmware version) from ThingsBoard.
+
+    Server-side coordinates win over client-side ones; a client-side firmware
+    version wins over the server-side one.
+    """
     try:
         # Get server-side attributes
         url = f"{thingsboard_url}/api/plugins/telemetry/DEVICE/{device_id}/values/attributes/SERVER_SCOPE"
-        r = requests.get(url, headers=headers)
-        
-        lat = None
-        lon = None
-        firmware_version = "1.0.0"  # Default
-        
-        if r.status_code == 200:
-            attributes = r.json()
-            for attr in attributes:
-                if attr['key'] == 'latitude':
-                    lat = float(attr['value'])
-                elif attr['key'] == 'longitude':
-                    lon = float(attr['value'])
-                elif attr['key'] in ['firmwareVersion', 'firmware_version', 'version']:
-                    firmware_version = str(attr['value'])
+        r = SESSION.get(url)
+        server = _collect_device_attributes(_json(r)) if r.status_code == 200 else {}
         
         # Also try client-side attributes
         url_client = f"{thingsboard_url}/api/plugins/telemetry/DEVICE/{device_id}/values/attributes/CLIENT_SCOPE"
-        r_client = requests.get(url_client, headers=headers)
+        r_client = SESSION.get(url_client)
+        client = _collect_device_attributes(_json(r_client)) if r_client.status_code == 200 else {}
         
-        if r_client.status_code == 200:
-            client_attributes = r_client.json()
-            for attr in client_attributes:
-                if attr['key'] == 'latitude' and lat is None:
-                    lat = float(attr['value'])
-                elif attr['key'] == 'longitude' and lon is None:
-                    lon = float(attr['value'])
-                elif attr['key'] in ['firmwareVersion', 'firmware_version', 'version']:
-                    firmware_version = str(attr['value'])
-        
-        return lat, lon, firmware_version
+        lat = server.get('lat', client.get('lat'))
+        lon = server.get('lon', client.get('lon'))
+        firmware_version = client.get('fw', server.get('fw', "1.0.0"))
+        return (float(lat) if lat is not None else None,
+                float(lon) if lon is not None else None,
+                str(firmware_version))
     except Exception as e:
-        print(f"⚠️ Could not fetch attributes for device {device_id}: {e}")
+        logger.warning(f"⚠️ Could not fetch attributes for device {device_id}: {e}")
         return None, None, "1.0.0"
 
-def save_asset_devices_to_db(devices, state_mapping, country_mapping):
-    """Save device-like assets to database as devices."""
-    if not devices:
-        print("ℹ️ No asset devices to save")
-        return
-    
-    config = load_config()
-    THINGSBOARD_URL = config.get('thingsboard', 'url')
-    JWT_TOKEN = config.get('thingsboard', 'jwt_token')
-    HEADERS = {
-        "Content-Type": "application/json",
-        "X-Authorization": f"Bearer {JWT_TOKEN}"
-    }
-    
-    conn = connect_to_db()
-    
+DEVICE_COLUMNS = ('device_name', 'serial_number', 'firmware_version',
+                  'location_lat', 'location_lon', 'state_id', 'country_id', 'created_at')
+
+def _format_value_for_copy(value):
+    """Render one value as a field of COPY's text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def copy_rows(cur, table, columns, rows):
+    """Stream rows into table's columns with COPY ... FROM STDIN."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(map(_format_value_for_copy, row)))
+        buf.write('\n')
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+def copy_devices(cur, rows):
+    """Upsert device rows (in DEVICE_COLUMNS order) via COPY into a temp staging table.
+
+    Serial numbers must be unique within rows. Returns (device_name, serial_number)
+    for every row written.
+    """
+    columns = ', '.join(DEVICE_COLUMNS)
+    cur.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS devices_stage ON COMMIT DROP AS
+        SELECT {columns} FROM devices WITH NO DATA;
+    """)
+    copy_rows(cur, 'devices_stage', DEVICE_COLUMNS, rows)
+    
+    cur.execute(f"""
+        INSERT INTO devices ({columns})
+        SELECT {columns} FROM devices_stage
+        ON CONFLICT (serial_number) DO UPDATE SET
+            device_name = EXCLUDED.device_name,
+            firmware_version = EXCLUDED.firmware_version,
+            location_lat = EXCLUDED.location_lat,
+            location_lon = EXCLUDED.location_lon
+        RETURNING device_name, serial_number;
+    """)
+    return cur.fetchall()
+
+def fetch_attributes_concurrently(fetch_fn, entity_ids, thingsboard_url):
+    """Call fetch_fn(entity_id, thingsboard_url) for every id on a thread pool.
+
+    The attribute fetches are independent blocking GETs, so they overlap well.
+    Returns {entity_id: result}.
+    """
+    with ThreadPoolExecutor(max_workers=ATTRIBUTE_FETCH_WORKERS) as executor:
+        results = executor.map(lambda entity_id: fetch_fn(entity_id, thingsboard_url), entity_ids)
+        return dict(zip(entity_ids, results))
+
+def _save_devices(conn, devices, state_mapping, country_mapping, now, serial_fn, attributes, label):
+    """Save devices to the devices table, stamped with created_at=now.
+
+    serial_fn(device) gives each device's serial number and attributes maps
+    device id -> (lat, lon, firmware_version); label names the devices in log lines.
+    """
     try:
         with conn.cursor() as cur:
+            # Assign every device to the first available state/country
+            if state_mapping:
+                default_state = list(state_mapping.values())[0]
+                state_id = default_state['db_id']
+                country_id = default_state['country_id']
+            elif country_mapping:
+                default_country = list(country_mapping.values())[0]
+                country_id = default_country['db_id']
+                # Create a default state
+                cur.execute("""
+                    INSERT INTO state_asset (state_name, country_id, created_at)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (country_id, state_name) DO UPDATE SET
+                        state_name = EXCLUDED.state_name
+                    RETURNING state_id;
+                """, ('DEFAULT_STATE', country_id, now))
+                state_id = cur.fetchone()[0]
+            else:
+                # Create default country and state in one statement
+                cur.execute("""
+                    WITH c AS (
+                        INSERT INTO country_asset (country_name, created_at)
+                        VALUES (%(country)s, %(now)s)
+                        ON CONFLICT (country_name) DO UPDATE SET
+                            country_name = EXCLUDED.country_name
+                        RETURNING country_id
+                    )
+                    INSERT INTO state_asset (state_name, country_id, created_at)
+                    SELECT %(state)s, country_id, %(now)s FROM c
+                    ON CONFLICT (country_id, state_name) DO UPDATE SET
+                        state_name = EXCLUDED.state_name
+                    RETURNING state_id, country_id;
+                """, {'country': 'DEFAULT_COUNTRY', 'state': 'DEFAULT_STATE', 'now': now})
+                state_id, country_id = cur.fetchone()
+            
+            # Keyed by serial number: a single upsert statement can't touch the same row twice
+            rows = {}
             for device in devices:
-                device_name = device['name']
-                
-                # Generate a serial number if not available
-                serial_number = f"ASSET_{device['id']['id'][:8]}"
-                firmware_version = "1.0.0"  # Default version
-                
-                # Try to get coordinates from ThingsBoard
-                lat, lon = get_asset_attributes(device['id']['id'], THINGSBOARD_URL, HEADERS)
+                serial_number = serial_fn(device)
+                lat, lon, firmware_version = attributes[device['id']['id']]
                 
                 # Use default coordinates if not found
                 if lat is None or lon is None:
                     lat, lon = 0.0, 0.0
                 
-                # Assign to first available state/country
-                if state_mapping:
-                    default_state = list(state_mapping.values())[0]
-                    state_id = default_state['db_id']
-                    country_id = default_state['country_id']
-                elif country_mapping:
-                    default_country = list(country_mapping.values())[0]
-                    country_id = default_country['db_id']
-                    # Create a default state
-                    cur.execute("""
-                        INSERT INTO state_asset (state_name, country_id, created_at)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (country_id, state_name) DO UPDATE SET
-                            state_name = EXCLUDED.state_name
-                        RETURNING state_id;
-                    """, ('DEFAULT_STATE', country_id, datetime.now()))
-                    state_id = cur.fetchone()[0]
-                else:
-                    # Create default country and state
-                    cur.execute("""
-                        INSERT INTO country_asset (country_name, created_at)
-                        VALUES (%s, %s)
-                        ON CONFLICT (country_name) DO UPDATE SET
-                            country_name = EXCLUDED.country_name
-                        RETURNING country_id;
-                    """, ('DEFAULT_COUNTRY', datetime.now()))
-                    country_id = cur.fetchone()[0]
-                    
-                    cur.execute("""
-                        INSERT INTO state_asset (state_name, country_id, created_at)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (country_id, state_name) DO UPDATE SET
-                            state_name = EXCLUDED.state_name
-                        RETURNING state_id;
-                    """, ('DEFAULT_STATE', country_id, datetime.now()))
-                    state_id = cur.fetchone()[0]
-                
-                # Insert device
-                cur.execute("""
-                    INSERT INTO devices (device_name, serial_number, firmware_version, 
-                                       location_lat, location_lon, state_id, country_id, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (serial_number) DO UPDATE SET
-                        device_name = EXCLUDED.device_name,
-                        firmware_version = EXCLUDED.firmware_version,
-                        location_lat = EXCLUDED.location_lat,
-                        location_lon = EXCLUDED.location_lon
-                    RETURNING device_id;
-                """, (device_name, serial_number, firmware_version, lat, lon, 
-                      state_id, country_id, datetime.now()))
-                
-                result = cur.fetchone()
-                if result:
-                    print(f"✅ Saved asset device: {device_name} (Serial: {serial_number})")
+                rows[serial_number] = (device['name'], serial_number, firmware_version, lat, lon,
+                                       state_id, country_id, now)
+            
+            # Stream all devices into the table in one COPY
+            results = copy_devices(cur, rows.values())
+            
+            for device_name, serial_number in results:
+                logger.debug("✅ Saved %s: %s (Serial: %s)", label, device_name, serial_number)
             
             conn.commit()
-            print(f"✅ Successfully saved {len(devices)} asset devices")
+            logger.info(f"✅ Successfully saved {len(devices)} {label}s")
             
     except Exception as e:
-        print(f"❌ Error saving asset devices: {e}")
+        logger.error(f"❌ Error saving {label}s: {e}")
         conn.rollback()
-    finally:
-        conn.close()
 
-def save_thingsboard_devices_to_db(tb_devices, state_mapping, country_mapping):
-    """Save actual ThingsBoard devices to database."""
-    if not tb_devices:
-        print("ℹ️ No ThingsBoard devices to save")
+def save_asset_devices_to_db(conn, devices, state_mapping, country_mapping, thingsboard_url, now,
+                             fetch_coordinates=True):
+    """Save device-like assets to database as devices, stamped with created_at=now.
+
+    With fetch_coordinates=False no attributes are requested and every device
+    gets the default (0.0, 0.0) coordinates.
+    """
+    if not devices:
+        logger.info("ℹ️ No asset devices to save")
         return
     
-    config = load_config()
-    THINGSBOARD_URL = config.get('thingsboard', 'url')
-    JWT_TOKEN = config.get('thingsboard', 'jwt_token')
-    HEADERS = {
-        "Content-Type": "application/json",
-        "X-Authorization": f"Bearer {JWT_TOKEN}"
-    }
+    # Fetch every device's attributes up front, before opening a transaction
+    device_ids = [device['id']['id'] for device in devices]
+    if fetch_coordinates:
+        coordinates = get_asset_coordinates(device_ids, thingsboard_url)
+    else:
+        coordinates = dict.fromkeys(device_ids, (None, None))
+    # Assets carry no firmware version; use the default
+    attributes = {device_id: (lat, lon, "1.0.0") for device_id, (lat, lon) in coordinates.items()}
+    
+    # Generate a serial number from the asset id
+    _save_devices(conn, devices, state_mapping, country_mapping, now,
+                  lambda device: f"ASSET_{device['id']['id'][:8]}", attributes, "asset device")
+
+def save_thingsboard_devices_to_db(conn, tb_devices, state_mapping, country_mapping, thingsboard_url, now):
+    """Save actual ThingsBoard devices to database, stamped with created_at=now."""
+    if not tb_devices:
+        logger.info("ℹ️ No ThingsBoard devices to save")
+        return
     
-    conn = connect_to_db()
+    # Fetch every device's attributes up front, before opening a transaction
+    attributes = fetch_attributes_concurrently(get_device_attributes, [device['id']['id'] for device in tb_devices],
+                                               thingsboard_url)
     
-    try:
-        with conn.cursor() as cur:
-            for device in tb_devices:
-                device_name = device['name']
-                device_id = device['id']['id']
-                
-                # Use device label as serial number if available, otherwise generate one
-                serial_number = device.get('label', f"DEV_{device_id[:8]}")
-                if not serial_number:
-                    serial_number = f"DEV_{device_id[:8]}"
-                
-                # Get device attributes (coordinates, firmware version)
-                lat, lon, firmware_version = get_device_attributes(device_id, THINGSBOARD_URL, HEADERS)
-                
-                # Use default coordinates if not found
-                if lat is None or lon is None:
-                    lat, lon = 0.0, 0.0
-                
-                # Assign to first available state/country
-                if state_mapping:
-                    default_state = list(state_mapping.values())[0]
-                    state_id = default_state['db_id']
-                    country_id = default_state['country_id']
-                elif country_mapping:
-                    default_country = list(country_mapping.values())[0]
-                    country_id = default_country['db_id']
-                    # Create a default state
-                    cur.execute("""
-                        INSERT INTO state_asset (state_name, country_id, created_at)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (country_id, state_name) DO UPDATE SET
-                            state_name = EXCLUDED.state_name
-                        RETURNING state_id;
-                    """, ('DEFAULT_STATE', country_id, datetime.now()))
-                    state_id = cur.fetchone()[0]
-                else:
-                    # Create default country and state
-                    cur.execute("""
-                        INSERT INTO country_asset (country_name, created_at)
-                        VALUES (%s, %s)
-                        ON CONFLICT (country_name) DO UPDATE SET
-                            country_name = EXCLUDED.country_name
-                        RETURNING country_id;
-                    """, ('DEFAULT_COUNTRY', datetime.now()))
-                    country_id = cur.fetchone()[0]
-                    
-                    cur.execute("""
-                        INSERT INTO state_asset (state_name, country_id, created_at)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (country_id, state_name) DO UPDATE SET
-                            state_name = EXCLUDED.state_name
-                        RETURNING state_id;
-                    """, ('DEFAULT_STATE', country_id, datetime.now()))
-                    state_id = cur.fetchone()[0]
-                
-                # Insert device
-                cur.execute("""
-                    INSERT INTO devices (device_name, serial_number, firmware_version, 
-                                       location_lat, location_lon, state_id, country_id, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (serial_number) DO UPDATE SET
-                        device_name = EXCLUDED.device_name,
-                        firmware_version = EXCLUDED.firmware_version,
-                        location_lat = EXCLUDED.location_lat,
-                        location_lon = EXCLUDED.location_lon
-                    RETURNING device_id;
-                """, (device_name, serial_number, firmware_version, lat, lon, 
-                      state_id, country_id, datetime.now()))
-                
-                result = cur.fetchone()
-                if result:
-                    print(f"✅ Saved ThingsBoard device: {device_name} (Serial: {serial_number})")
-            
-            conn.commit()
-            print(f"✅ Successfully saved {len(tb_devices)} ThingsBoard devices")
-            
-    except Exception as e:
-        print(f"❌ Error saving ThingsBoard devices: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+    # Use device label as serial number if available, otherwise generate one
+    _save_devices(conn, tb_devices, state_mapping, country_mapping, now,
+                  lambda device: device.get('label') or f"DEV_{device['id']['id'][:8]}", attributes,
+                  "ThingsBoard device")
 
-def main():
+def main(argv=None):
     """Main execution function."""
-    print("🚀 Starting ThingsBoard asset and device extraction and database save...")
+    args = parser.parse_args(argv)
+    # LOGLEVEL=DEBUG adds one line per saved or related row; WARNING keeps only problems
+    level = os.environ.get('LOGLEVEL', 'INFO').upper()
+    known_level = level in logging.getLevelNamesMapping()
+    logging.basicConfig(level=level if known_level else 'INFO', format='%(message)s')
+    if not known_level:
+        logger.warning(f"⚠️ Unknown LOGLEVEL '{level}', using INFO")
+    logger.info("🚀 Starting ThingsBoard asset and device extraction and database save...")
     
     # Load config for categorization and database
     config = load_config()
     load_db_config(config)
+    thingsboard_url, _ = get_tb_client()
     
     # Fetch all assets from ThingsBoard
-    assets = fetch_thingsboard_assets()
+    assets = fetch_thingsboard_assets(thingsboard_url)
     if not assets:
-        print("❌ No assets found. Exiting.")
+        logger.error("❌ No assets found. Exiting.")
         return
     
     # Fetch all devices from ThingsBoard
-    tb_devices = fetch_thingsboard_devices()
+    tb_devices = fetch_thingsboard_devices(thingsboard_url)
     
     # Categorize assets using config profile names
     countries, states, asset_devices = categorize_assets(assets, config)
     
     # Fetch asset relations to map states to countries
-    THINGSBOARD_URL = config.get('thingsboard', 'url')
-    JWT_TOKEN = config.get('thingsboard', 'jwt_token')
-    HEADERS = {
-        "Content-Type": "application/json",
-        "X-Authorization": f"Bearer {JWT_TOKEN}"
-    }
-    
-    relations = get_asset_relations(THINGSBOARD_URL, HEADERS)
+    relations = get_asset_relations(thingsboard_url, countries)
     state_country_relations = find_state_country_mapping(states, countries, relations)
     
     # Display categorization for review
-    print("\n📋 Asset Categorization:")
-    print("Countries:")
+    logger.info("\n📋 Asset Categorization:")
+    logger.info("Countries:")
     for country in countries:
-        print(f"  - {country['name']} (Type: {country.get('type', 'N/A')})")
+        logger.info(f"  - {country['name']} (Type: {country.get('type', 'N/A')})")
     
-    print("States:")
+    logger.info("States:")
     for state in states:
-        print(f"  - {state['name']} (Type: {state.get('type', 'N/A')})")
+        logger.info(f"  - {state['name']} (Type: {state.get('type', 'N/A')})")
     
-    print("Other Assets (will be treated as devices):")
+    logger.info("Other Assets (will be treated as devices):")
     for device in asset_devices[:10]:  # Show first 10 only
-        print(f"  - {device['name']} (Type: {device.get('type', 'N/A')})")
+        logger.info(f"  - {device['name']} (Type: {device.get('type', 'N/A')})")
     if len(asset_devices) > 10:
-        print(f"  ... and {len(asset_devices) - 10} more")
+        logger.info(f"  ... and {len(asset_devices) - 10} more")
     
-    print(f"\nThingsBoard Devices:")
+    logger.info(f"\nThingsBoard Devices:")
     for device in tb_devices[:10]:  # Show first 10 only
-        print(f"  - {device['name']} (Label: {device.get('label', 'N/A')})")
+        logger.info(f"  - {device['name']} (Label: {device.get('label', 'N/A')})")
     if len(tb_devices) > 10:
-        print(f"  ... and {len(tb_devices) - 10} more")
+        logger.info(f"  ... and {len(tb_devices) - 10} more")
     
-    print(f"\n🔗 State-Country Relations Found: {len(state_country_relations)}")
+    logger.info(f"\n🔗 State-Country Relations Found: {len(state_country_relations)}")
+    state_name_by_id = {state['id']['id']: state['name'] for state in states}
+    country_name_by_id = {country['id']['id']: country['name'] for country in countries}
     for state_id, country_id in state_country_relations.items():
-        state_name = next((s['name'] for s in states if s['id']['id'] == state_id), 'Unknown')
-        country_name = next((c['name'] for c in countries if c['id']['id'] == country_id), 'Unknown')
-        print(f"  - {state_name} → {country_name}")
+        state_name = state_name_by_id.get(state_id, 'Unknown')
+        country_name = country_name_by_id.get(country_id, 'Unknown')
+        logger.info(f"  - {state_name} → {country_name}")
     
-    # Ask for confirmation
-    response = input("\n❓ Proceed with saving to database? (y/N): ")
-    if response.lower() != 'y':
-        print("❌ Operation cancelled by user.")
+    if args.dry_run:
+        logger.info("\nℹ️ Dry run: nothing saved to the database.")
         return
     
+    # Ask for confirmation
+    if not args.yes:
+        response = input("\n❓ Proceed with saving to database? (y/N): ")
+        if response.lower() != 'y':
+            logger.error("❌ Operation cancelled by user.")
+            return
+    
     # Save to database with proper relationships
-    print("\n💾 Saving to database...")
-    country_mapping = save_countries_to_db(countries)
-    state_mapping = save_states_to_db(states, country_mapping, state_country_relations)
-    save_asset_devices_to_db(asset_devices, state_mapping, country_mapping)
-    save_thingsboard_devices_to_db(tb_devices, state_mapping, country_mapping)
-    
-    print("\n✅ Asset and device extraction and database save completed!")
-    print(f"📊 Summary: {len(countries)} countries, {len(states)} states, {len(asset_devices)} asset devices, {len(tb_devices)} ThingsBoard devices saved")
+    logger.info("\n💾 Saving to database...")
+    # One connection for the whole save; each phase commits or rolls back on its own.
+    # Every row written by this run shares one created_at.
+    now = datetime.now()
+    conn = connect_to_db()
+    # The two device saves only read the mappings, so they run side by side; a psycopg2
+    # connection holds one transaction at a time, so the second one gets its own
+    device_conn = connect_to_db()
+    try:
+        country_mapping = save_countries_to_db(conn, countries, now)
+        state_mapping = save_states_to_db(conn, states, country_mapping, state_country_relations, now)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(save_asset_devices_to_db, conn, asset_devices, state_mapping, country_mapping,
+                                thingsboard_url, now,
+                                fetch_coordinates=config.getboolean('thingsboard', 'fetch_asset_coordinates',
+                                                                    fallback=True)),
+                executor.submit(save_thingsboard_devices_to_db, device_conn, tb_devices, state_mapping,
+                                country_mapping, thingsboard_url, now),
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        device_conn.close()
+        conn.close()
+    
+    logger.info("\n✅ Asset and device extraction and database save completed!")
+    logger.info(f"📊 Summary: {len(countries)} countries, {len(states)} states, {len(asset_devices)} asset devices, {len(tb_devices)} ThingsBoard devices saved")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,11 +3,18 @@
 Helper script to get JWT token from ThingsBoard
 """
 import requests
+import orjson
 import json
 import configparser
 import os
+import base64
+import threading
+import time
 
-def get_jwt_token(base_url, username, password):
+# Log in again this many seconds before the current token's exp claim
+REFRESH_MARGIN_SECONDS = 60
+
+def get_jwt_token(base_url, username, password, session=None):
     """
     Get JWT token from ThingsBoard using username/password
     
@@ -15,6 +22,7 @@ def get_jwt_token(base_url, username, password):
         base_url: ThingsBoard server URL
         username: Your ThingsBoard username
         password: Your ThingsBoard password
+        session: Optional requests.Session to log in over (reuses its open connection)
         
     Returns:
         JWT token string or None if failed
@@ -27,15 +35,14 @@ def get_jwt_token(base_url, username, password):
     }
     
     try:
-        response = requests.post(login_url, json=payload)
+        response = (session or requests).post(login_url, json=payload)
         response.raise_for_status()
         
-        result = response.json()
+        result = orjson.loads(response.content)
         token = result.get('token')
         
         if token:
             print(f"✅ Successfully obtained JWT token")
-            print(f"Token: {token}")
             return token
         else:
             print("❌ No token in response")
@@ -50,6 +57,52 @@ def get_jwt_token(base_url, username, password):
         print(f"❌ Error: {e}")
         return None
 
+def token_expiry(token):
+    """Return the exp claim (epoch seconds) of a JWT, read without verifying the signature"""
+    payload = token.split('.')[1]
+    payload += '=' * (-len(payload) % 4)
+    return orjson.loads(base64.urlsafe_b64decode(payload))['exp']
+
+class TokenManager:
+    """
+    Keep a ThingsBoard JWT fresh by logging in again shortly before it expires
+    
+    An instance is a requests auth callable: set session.auth = TokenManager(...)
+    and every request goes out with a current X-Authorization header.
+    """
+    
+    def __init__(self, base_url, username, password, token=None, session=None):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.session = session
+        self.token = None
+        self.expires_at = 0
+        self._lock = threading.Lock()
+        if token:
+            self._set_token(token)
+    
+    def _set_token(self, token):
+        self.token = token
+        self.expires_at = token_expiry(token)
+    
+    def get_token(self):
+        """Return a token that is valid for at least REFRESH_MARGIN_SECONDS, refreshing if needed"""
+        with self._lock:
+            if time.time() > self.expires_at - REFRESH_MARGIN_SECONDS:
+                token = get_jwt_token(self.base_url, self.username, self.password, self.session)
+                if not token:
+                    raise RuntimeError("Failed to refresh ThingsBoard JWT token")
+                self._set_token(token)
+            return self.token
+    
+    def __call__(self, request):
+        # The login call itself may go over the same session; it must not wait on a token
+        if request.url.endswith('/api/auth/login'):
+            return request
+        request.headers['X-Authorization'] = f"Bearer {self.get_token()}"
+        return request
+
 def update_config_with_token(token, config_file="config.properties"):
     """Update config.properties file with the JWT token"""
     config = configparser.ConfigParser()
@@ -83,6 +136,7 @@ if __name__ == "__main__":
     token = get_jwt_token(base_url, username, password)
     
     if token:
+        print(f"Token: {token}")
         update_config_with_token(token)
         print("\n🎉 Ready to use! You can now run your device service.")
     else:
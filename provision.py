@@ -1,15 +1,45 @@
 
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import random
+import configparser
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Config
 THINGSBOARD_URL = "https://thingsboard-poc.papayaparking.com"
-JWT_TOKEN = "eyJhbGciOiJIUzUxMiJ9.eyJzdWIiOiJzaGl2YWppLmRva2VAbmV1cmFiaXRzb2x1dGlvbi5jb20iLCJ1c2VySWQiOiJkZDFkMTAwMC02NjMzLTExZjAtOGU1YS05ZDZmYjhjYmI5OTEiLCJzY29wZXMiOlsiVEVOQU5UX0FETUlOIl0sInNlc3Npb25JZCI6IjEzMDhjM2RiLWNmYjMtNDcwOS04OWI5LTAzMjliNTM1YzRjYSIsImV4cCI6MTc1Mzc3MTc2NSwiaXNzIjoidGhpbmdzYm9hcmQuaW8iLCJpYXQiOjE3NTM3NjI3NjUsImZpcnN0TmFtZSI6IlNoaXZhamkiLCJsYXN0TmFtZSI6IkRva2UiLCJlbmFibGVkIjp0cnVlLCJpc1B1YmxpYyI6ZmFsc2UsInRlbmFudElkIjoiMGU0NDBkNTAtNGM5ZS0xMWYwLTk2MTYtMTU4M2M3ZDQyYmY1IiwiY3VzdG9tZXJJZCI6IjEzODE0MDAwLTFkZDItMTFiMi04MDgwLTgwODA4MDgwODA4MCJ9.0mntRnahm9KMJfVCDZExlW_Aset_HAcjEWxFcG2DA1QGZeYB1TApSM0FdKEBf4e6AGSBCKvDVZeF5sDcM6u0fQ"  # Truncated for readability
-HEADERS = {
-    "Content-Type": "application/json",
-    "X-Authorization": f"Bearer {JWT_TOKEN}"
-}
+ASSET_URL = f"{THINGSBOARD_URL}/api/asset"
+DEVICE_URL = f"{THINGSBOARD_URL}/api/device"
+RELATION_URL = f"{THINGSBOARD_URL}/api/relation"
+
+@functools.lru_cache(maxsize=1)
+def _headers():
+    """Build the request headers from config.properties on first use, so importing stays cheap."""
+    config = configparser.ConfigParser()
+    config.read("config.properties")
+    return {
+        "Content-Type": "application/json",
+        "X-Authorization": f"Bearer {config.get('thingsboard', 'jwt_token')}"
+    }
+
+def _authorize(request):
+    """requests auth hook: add the (cached) headers to every request sent on SESSION."""
+    request.headers.update(_headers())
+    return request
+
+# Shared keep-alive session, so every call reuses one connection to ThingsBoard
+SESSION = requests.Session()
+SESSION.auth = _authorize
+SESSION.mount(THINGSBOARD_URL, HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=8,
+    # Only idempotent methods are retried, so a create is never sent twice
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504])
+))
 
 # Inputs
 COUNTRY_NAME = "UK"
@@ -24,6 +54,31 @@ LON = 72.8777
 COUNTRY_PROFILE_ID = "794f19f0-66bb-11f0-8e5a-9d6fb8cbb991"
 STATE_PROFILE_ID = "93a69210-66bb-11f0-8e5a-9d6fb8cbb991"
 
+# Attempts for a POST that ThingsBoard throttles with 429 (the request was not processed)
+THROTTLE_ATTEMPTS = 5
+
+def post_with_backoff(url, body):
+    """POST an encoded JSON body, backing off and retrying while ThingsBoard answers 429."""
+    for attempt in range(THROTTLE_ATTEMPTS):
+        r = SESSION.post(url, data=body)
+        if r.status_code != 429 or attempt == THROTTLE_ATTEMPTS - 1:
+            return r
+        retry_after = r.headers.get("Retry-After", "")
+        time.sleep(float(retry_after) if retry_after.isdigit() else 0.5 * 2 ** attempt)
+
+def _json(r):
+    """Decode a response body with orjson."""
+    return orjson.loads(r.content)
+
+# Pre-serialized device body; only the %s fields vary per call and are JSON-encoded individually
+_DEVICE_TMPL = (b'{"name":%s,"label":%s,'
+                b'"deviceProfileId":{"entityType":"DEVICE_PROFILE","id":%s},'
+                b'"additionalInfo":{"gateway":false,"overwriteActivityTime":false,'
+                b'"description":"Simulated IoT device"}}')
+# Pre-serialized "Contains" relation body: parent id/type, then child id/type
+_RELATION_TMPL = (b'{"from":{"id":%s,"entityType":%s},"to":{"id":%s,"entityType":%s},'
+                  b'"type":"Contains","typeGroup":"COMMON"}')
+
 def create_asset(name, profile_id, type_name):
     payload = {
         "name": name,
@@ -36,9 +91,9 @@ def create_asset(name, profile_id, type_name):
             "description": f"{type_name} asset created by simulator"
         }
     }
-    r = requests.post(f"{THINGSBOARD_URL}/api/asset", headers=HEADERS, json=payload)
+    r = post_with_backoff(ASSET_URL, orjson.dumps(payload))
     r.raise_for_status()
-    return r.json()
+    return _json(r)
 
 def send_asset_attributes(entity_type, entity_id, latitude, longitude):
     url = f"{THINGSBOARD_URL}/api/plugins/telemetry/{entity_type}/{entity_id}/attributes/SERVER_SCOPE"
@@ -46,71 +101,63 @@ def send_asset_attributes(entity_type, entity_id, latitude, longitude):
         "latitude": latitude,
         "longitude": longitude
     }
-    r = requests.post(url, headers=HEADERS, json=payload)
+    r = post_with_backoff(url, orjson.dumps(payload))
     r.raise_for_status()
     print(f"✅ Sent latitude/longitude to {entity_type} {entity_id}")
 
 def create_device(name, device_profile_id):
-    payload = {
-        "name": name,
-        "label": name,
-        "deviceProfileId": {
-            "entityType": "DEVICE_PROFILE",
-            "id": device_profile_id
-        },
-        "additionalInfo": {
-            "gateway": False,
-            "overwriteActivityTime": False,
-            "description": "Simulated IoT device"
-        }
-    }
-    r = requests.post(f"{THINGSBOARD_URL}/api/device", headers=HEADERS, json=payload)
+    encoded_name = orjson.dumps(name)
+    body = _DEVICE_TMPL % (encoded_name, encoded_name, orjson.dumps(device_profile_id))
+    r = post_with_backoff(DEVICE_URL, body)
     r.raise_for_status()
-    return r.json()
+    return _json(r)
 
-def assign_child_asset(parent_id, child_id):
-    url = f"{THINGSBOARD_URL}/api/relation"
-    relation_payload = {
-        "from": {
-            "id": parent_id,
-            "entityType": "ASSET"
-        },
-        "to": {
-            "id": child_id,
-            "entityType": "ASSET"
-        },
-        "type": "Contains",
-        "typeGroup": "COMMON"
-    }
-    r = requests.post(url, headers=HEADERS, json=relation_payload)
+def create_devices(names, device_profile_id, max_workers=8):
+    """Create many devices concurrently over the shared session.
+
+    Returns one {"success": True, "data": device} or {"success": False, "error": message}
+    per name, in the same order as names.
+    """
+    def create(name):
+        try:
+            return {"success": True, "data": create_device(name, device_profile_id)}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(create, names))
+
+def create_relation(parent_id, parent_type, child_id, child_type):
+    body = _RELATION_TMPL % (orjson.dumps(parent_id), orjson.dumps(parent_type),
+                             orjson.dumps(child_id), orjson.dumps(child_type))
+    r = post_with_backoff(RELATION_URL, body)
     r.raise_for_status()
 
+def assign_child_asset(parent_id, child_id):
+    create_relation(parent_id, "ASSET", child_id, "ASSET")
+
 def assign_device_to_asset(device_id, asset_id):
-    url = f"{THINGSBOARD_URL}/api/relation"
-    relation_payload = {
-        "from": {
-            "id": asset_id,
-            "entityType": "ASSET"
-        },
-        "to": {
-            "id": device_id,
-            "entityType": "DEVICE"
-        },
-        "type": "Contains",
-        "typeGroup": "COMMON"
-    }
-    r = requests.post(url, headers=HEADERS, json=relation_payload)
-    r.raise_for_status()
+    create_relation(asset_id, "ASSET", device_id, "DEVICE")
+
+def bulk_create_relations(edges, max_workers=8):
+    """Create a Contains relation for every (parent_id, parent_type, child_id, child_type) edge.
+
+    ThingsBoard has no batch endpoint for relations (POST /api/relations is a query),
+    so the edges are sent concurrently over the shared session rather than one by one.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() surfaces the first failed relation as an exception here
+        list(executor.map(lambda edge: create_relation(*edge), edges))
 
 def get_device_credentials(device_id):
-    url = f"{THINGSBOARD_URL}/api/device/{device_id}/credentials"
-    r = requests.get(url, headers=HEADERS)
+    url = f"{DEVICE_URL}/{device_id}/credentials"
+    r = SESSION.get(url)
     r.raise_for_status()
-    return r.json()["credentialsId"]
+    return _json(r)["credentialsId"]
 
-def send_telemetry(device_token):
-    telemetry_url = f"{THINGSBOARD_URL}/api/v1/{device_token}/telemetry"
-    payload = {
+def telemetry_values():
+    """Return one simulated telemetry sample for the configured device."""
+    return {
         "serialNumber": SERIAL_NUMBER,
         "country": COUNTRY_NAME,
         "state": STATE_NAME,
@@ -118,33 +165,138 @@ def send_telemetry(device_token):
         "longitude": LON,
         "temperature": round(random.uniform(20, 40), 2)
     }
-    r = requests.post(telemetry_url, json=payload)
+
+def send_telemetry(device_token):
+    telemetry_url = f"{THINGSBOARD_URL}/api/v1/{device_token}/telemetry"
+    payload = telemetry_values()
+    r = post_with_backoff(telemetry_url, orjson.dumps(payload))
     r.raise_for_status()
     print("Telemetry sent:", payload)
 
-# ---- Execution ----
-
-print("Creating country asset...")
-country_asset = create_asset(COUNTRY_NAME, COUNTRY_PROFILE_ID, "Country")
-send_asset_attributes("ASSET", country_asset["id"]["id"], 55.3781, -3.4360)  # UK lat/lon
+def send_telemetry_points(device_token, points):
+    """Send (ts, values) points, ts in epoch milliseconds, as one timestamped array POST."""
+    telemetry_url = f"{THINGSBOARD_URL}/api/v1/{device_token}/telemetry"
+    payload = [{"ts": ts, "values": values} for ts, values in points]
+    r = post_with_backoff(telemetry_url, orjson.dumps(payload))
+    r.raise_for_status()
+    print(f"Telemetry sent: {len(payload)} samples")
 
-print("Creating state asset...")
-state_asset = create_asset(STATE_NAME, STATE_PROFILE_ID, "State")
-send_asset_attributes("ASSET", state_asset["id"]["id"], 51.5074, -0.1278)   # London lat/lon
+class TelemetryBuffer:
+    """Queue telemetry for one device and send it in batches.
 
-print("Linking state to country...")
-assign_child_asset(country_asset["id"]["id"], state_asset["id"]["id"])
+    A batch is sent once flush_every_n points are queued, or flush_every_ms after
+    the first point of the batch was queued, whichever comes first. A failed send
+    keeps its points queued; after a failed timed flush they are retried every
+    flush_every_ms. Use it as a context manager (or call flush()) so the last
+    partial batch is sent too.
+    """
+    
+    def __init__(self, device_token, flush_every_n=32, flush_every_ms=1000):
+        self.device_token = device_token
+        self.flush_every_n = flush_every_n
+        self.flush_every_ms = flush_every_ms
+        self._points = []
+        self._timer = None
+        self._lock = threading.Lock()
+    
+    def add(self, values, ts=None):
+        """Queue one sample; ts defaults to now."""
+        with self._lock:
+            self._points.append((int(time.time() * 1000) if ts is None else ts, values))
+            if len(self._points) < self.flush_every_n:
+                self._arm_timer()
+                return
+            batch = self._take()
+        self._send(batch)
+    
+    def _arm_timer(self):
+        """Start the flush timer unless one is pending; the caller holds _lock."""
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_every_ms / 1000, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def _take(self):
+        """Detach the queued points and disarm the timer; the caller holds _lock."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._points = self._points, []
+        return batch
+    
+    def _send(self, batch):
+        """Send a detached batch; if that fails, put its points back at the front and re-raise."""
+        try:
+            send_telemetry_points(self.device_token, batch)
+        except Exception:
+            with self._lock:
+                self._points[:0] = batch
+            raise
+    
+    def _flush_on_timer(self):
+        # Nobody waits on the timer thread, so report a failure here and try again later
+        with self._lock:
+            batch = self._take()
+        if not batch:
+            return
+        try:
+            self._send(batch)
+        except Exception as e:
+            print(f"❌ Telemetry flush of {len(batch)} samples failed, retrying in {self.flush_every_ms} ms: {e}")
+            with self._lock:
+                self._arm_timer()
+    
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.flush()
 
-print("Creating device...")
-device = create_device(DEVICE_NAME, DEVICE_PROFILE_ID)
+def create_asset_with_attributes(name, profile_id, type_name, latitude, longitude):
+    """Create an asset and write its coordinates straight away, on the same connection."""
+    asset = create_asset(name, profile_id, type_name)
+    send_asset_attributes("ASSET", asset["id"]["id"], latitude, longitude)
+    return asset
 
-print("Linking device to state...")
-assign_device_to_asset(device["id"]["id"], state_asset["id"]["id"])
+def create_device_with_credentials(name, device_profile_id):
+    """Create a device and fetch its access token; returns (device, token)."""
+    device = create_device(name, device_profile_id)
+    return device, get_device_credentials(device["id"]["id"])
 
-print("Getting device token...")
-device_token = get_device_credentials(device["id"]["id"])
+# ---- Execution ----
 
-print("Sending telemetry...")
-send_telemetry(device_token)
+def main():
+    # Each leg chains the calls that only need its own entity's ID, so no leg waits
+    # on another; only the relations need IDs from two legs, and telemetry waits for
+    # the relations so anything following the state's Contains relation sees it
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        print("Creating country asset, state asset and device...")
+        country_future = executor.submit(create_asset_with_attributes, COUNTRY_NAME, COUNTRY_PROFILE_ID, "Country",
+                                         55.3781, -3.4360)  # UK lat/lon
+        state_future = executor.submit(create_asset_with_attributes, STATE_NAME, STATE_PROFILE_ID, "State",
+                                       51.5074, -0.1278)   # London lat/lon
+        device_future = executor.submit(create_device_with_credentials, DEVICE_NAME, DEVICE_PROFILE_ID)
+        
+        country_asset = country_future.result()
+        state_asset = state_future.result()
+        device, device_token = device_future.result()
+    
+    print("Linking state to country and device to state...")
+    bulk_create_relations([
+        (country_asset["id"]["id"], "ASSET", state_asset["id"]["id"], "ASSET"),
+        (state_asset["id"]["id"], "ASSET", device["id"]["id"], "DEVICE"),
+    ])
+    
+    print("Sending telemetry...")
+    send_telemetry(device_token)
+    
+    print("✅ All done!")
 
-print("✅ All done!")
+if __name__ == "__main__":
+    main()